@@ -0,0 +1,81 @@
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import NotFound
+
+from api.search import ingredient_index
+from api.serializers import IngredientSerializer, TagSerializer
+from api.views import IngredientViewSet, TagViewSet
+from recipes.models import Ingredient, Tag
+
+
+class AsyncReadView(View):
+    """Асинхронное чтение публичных справочников для запуска под ASGI.
+    GET выполняется корутиной с асинхронным ORM и не занимает поток,
+    остальные методы передаются синхронному вьюсету DRF
+    с теми же действиями, что и в роутере."""
+    viewset = None
+    actions = None
+    sync_view = None
+    queryset = None
+    serializer_class = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        viewset = initkwargs.get('viewset', cls.viewset)
+        actions = initkwargs.get('actions', cls.actions)
+        initkwargs['sync_view'] = sync_to_async(viewset.as_view(actions))
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def get(self, request, pk=None):
+        if pk is None:
+            return self.response(await self.list_data(request))
+        try:
+            obj = await self.queryset.aget(pk=pk)
+        except (self.queryset.model.DoesNotExist, ValueError):
+            return self.response(
+                {'detail': NotFound.default_detail}, status=404)
+        return self.response(self.serializer_class(obj).data)
+
+    async def list_data(self, request, queryset=None):
+        if queryset is None:
+            queryset = self.queryset.all()
+        return self.serializer_class(
+            [obj async for obj in queryset], many=True).data
+
+    async def delegate(self, request, *args, **kwargs):
+        return await self.sync_view(request, *args, **kwargs)
+
+    post = put = patch = delete = delegate
+
+    @staticmethod
+    def response(data, status=200):
+        return JsonResponse(data, status=status, safe=False,
+                            json_dumps_params={'ensure_ascii': False,
+                                               'separators': (',', ':')})
+
+
+class TagAsyncView(AsyncReadView):
+    viewset = TagViewSet
+    queryset = Tag.objects.all()
+    serializer_class = TagSerializer
+
+
+class IngredientAsyncView(AsyncReadView):
+    """Поиск по названию обслуживается индексом в памяти,
+    как в IngredientViewSet.list."""
+    viewset = IngredientViewSet
+    queryset = Ingredient.objects.all()
+    serializer_class = IngredientSerializer
+
+    async def list_data(self, request, queryset=None):
+        name = request.GET.get('name')
+        measurement_unit = request.GET.get('measurement_unit')
+        if name:
+            return await sync_to_async(ingredient_index.search)(
+                name, measurement_unit)
+        queryset = self.queryset.all()
+        if measurement_unit:
+            queryset = queryset.filter(measurement_unit=measurement_unit)
+        return await super().list_data(request, queryset)
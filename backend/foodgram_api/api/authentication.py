@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from api import metrics
+from users.models import CustomUser
+
+TOKEN_KEY = 'auth_token_user:{}'
+# Поля пользователя, которые хранятся в кешах токенов.
+AUTH_FIELDS = ('id', 'is_active', 'is_staff', 'is_superuser')
+
+metrics.register('auth_token_cache_hits', 'auth_token_cache_misses')
+
+
+class LocalTokenCache:
+    """Процессный LRU-кеш токенов с ограниченным временем жизни."""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.timeout, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+local_tokens = LocalTokenCache(settings.AUTH_TOKEN_LOCAL_SIZE,
+                               settings.AUTH_TOKEN_LOCAL_TIMEOUT)
+
+
+def invalidate_tokens(keys):
+    """Удаляет токены из кешей при выходе, смене пароля
+    или изменении пользователя. Локальные кеши других процессов
+    устаревают не позже чем через AUTH_TOKEN_LOCAL_TIMEOUT секунд."""
+    keys = list(keys)
+    for key in keys:
+        local_tokens.delete(key)
+    if settings.AUTH_TOKEN_SHARED_CACHE and keys:
+        cache.delete_many([TOKEN_KEY.format(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе на каждый запрос.
+    Токен ищется в процессном LRU-кеше, затем в общем кеше
+    (AUTH_TOKEN_SHARED_CACHE) и только потом в базе. В кешах
+    хранятся только поля AUTH_FIELDS, без хеша пароля и профиля:
+    пользователь восстанавливается из них для каждого запроса,
+    остальные поля загружаются из базы при обращении.
+    Записи сбрасываются сигналами (api/signals.py)."""
+
+    def authenticate_credentials(self, key):
+        data = local_tokens.get(key)
+        if data is None and settings.AUTH_TOKEN_SHARED_CACHE:
+            data = cache.get(TOKEN_KEY.format(key))
+            if data is not None:
+                local_tokens.set(key, data)
+        if data is None:
+            metrics.increment('auth_token_cache_misses')
+            user, token = super().authenticate_credentials(key)
+            self.remember(key, user)
+            return user, token
+        metrics.increment('auth_token_cache_hits')
+        if not data['is_active']:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return self.restore(key, data)
+
+    @staticmethod
+    def restore(key, data):
+        db = CustomUser.objects.db
+        user = CustomUser.from_db(
+            db, AUTH_FIELDS, [data[field] for field in AUTH_FIELDS])
+        token = Token.from_db(db, ('key', 'user_id'), (key, user.pk))
+        token.user = user
+        return user, token
+
+    @staticmethod
+    def remember(key, user):
+        data = {field: getattr(user, field) for field in AUTH_FIELDS}
+        local_tokens.set(key, data)
+        if settings.AUTH_TOKEN_SHARED_CACHE:
+            cache.set(TOKEN_KEY.format(key), data,
+                      settings.AUTH_TOKEN_CACHE_TIMEOUT)
@@ -0,0 +1,108 @@
+from collections import namedtuple
+
+from django.db import transaction
+
+from api.loaders import invalidate_user_ids
+from recipes.models import Favorites, Recipe, ShoppingCart
+from recipes.utils import (change_counters, lock_users, recipes_amounts,
+                           update_shopping_lists)
+
+BULK_MAX_ITEMS = 1000
+BULK_MAX_RECIPES = 100
+
+Relation = namedtuple('Relation', ('model', 'counter', 'shopping_list'))
+
+# Ключи совпадают с видами массивов id в api.loaders.
+RELATIONS = {
+    'favorites': Relation(Favorites, 'favorites_count', False),
+    'shopping_cart': Relation(ShoppingCart, 'in_carts_count', True),
+}
+
+
+def lock_user(user):
+    """Сериализует массовые и одиночные операции пользователя
+    с избранным и корзиной, чтобы счетчики и список покупок
+    не учли запись дважды."""
+    lock_users((user.pk,))
+
+
+def existing_recipes(ids):
+    return set(Recipe.objects.filter(id__in=ids).values_list('id', flat=True))
+
+
+def related_recipes(relation, user, ids):
+    return set(relation.model.objects.filter(
+        user=user, recipe__in=ids).values_list('recipe', flat=True))
+
+
+def bulk_add(user, kind, ids):
+    """Добавляет рецепты ids в избранное или корзину пользователя.
+    Существование рецептов и уже добавленные проверяются двумя
+    запросами на весь список, записи создаются одним INSERT,
+    счетчики популярности - одним UPDATE, список покупок
+    пересчитывается один раз по сумме ингредиентов новых рецептов.
+    Возвращает статусы added, exists или not_found по каждому id."""
+    relation = RELATIONS[kind]
+    ids = list(dict.fromkeys(ids))
+    with transaction.atomic():
+        lock_user(user)
+        found = existing_recipes(ids)
+        present = related_recipes(relation, user, found)
+        added = found - present
+        relation.model.objects.bulk_create(
+            [relation.model(user=user, recipe_id=pk) for pk in added],
+            ignore_conflicts=True)
+        change_counters(added, relation.counter, 1)
+        if relation.shopping_list and added:
+            update_shopping_lists((user.id,), recipes_amounts(added))
+        if added:
+            invalidate_user_ids(user, kind)
+    return [
+        {'id': pk, 'status': 'added' if pk in added
+         else 'exists' if pk in present else 'not_found'}
+        for pk in ids
+    ]
+
+
+def bulk_remove(user, kind, ids):
+    """Удаляет рецепты ids из избранного или корзины пользователя
+    одним DELETE. Возвращает статусы removed, absent или not_found."""
+    relation = RELATIONS[kind]
+    ids = list(dict.fromkeys(ids))
+    with transaction.atomic():
+        lock_user(user)
+        found = existing_recipes(ids)
+        removed = related_recipes(relation, user, found)
+        if relation.shopping_list and removed:
+            update_shopping_lists((user.id,), {
+                key: -value
+                for key, value in recipes_amounts(removed).items()})
+        relation.model.objects.filter(
+            user=user, recipe__in=removed).delete()
+        change_counters(removed, relation.counter, -1)
+        if removed:
+            invalidate_user_ids(user, kind)
+    return [
+        {'id': pk, 'status': 'removed' if pk in removed
+         else 'absent' if pk in found else 'not_found'}
+        for pk in ids
+    ]
+
+
+def bulk_create_recipes(serializer_class, payloads, context):
+    """Создает рецепты из списка payloads в одной транзакции.
+    Каждый рецепт проверяется отдельно, ошибки одного не мешают
+    остальным. Общий context позволяет сериализатору не проверять
+    повторно уже известные ингредиенты. Возвращает по каждому
+    элементу id созданного рецепта или ошибки."""
+    results = []
+    with transaction.atomic():
+        for payload in payloads:
+            serializer = serializer_class(data=payload, context=context)
+            if serializer.is_valid():
+                results.append({'id': serializer.save().pk,
+                                'status': 'created'})
+            else:
+                results.append({'errors': serializer.errors,
+                                'status': 'invalid'})
+    return results
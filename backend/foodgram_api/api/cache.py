@@ -0,0 +1,155 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from api import metrics
+
+GENERATION_KEY = 'generation:{}'
+MODIFIED_KEY = 'generation:{}:modified'
+RESPONSE_KEY = 'response:{}'
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+FRAGMENT_KEY = 'fragment:{}'
+FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
+metrics.register('response_cache_hits', 'response_cache_misses',
+                 'fragment_cache_hits', 'fragment_cache_misses')
+
+
+def new_generation():
+    """Начальное значение счетчика поколения. Счетчик может быть
+    вытеснен из кеша, и заново созданный с нуля повторил бы номера,
+    под которыми уже лежат устаревшие ответы. Время в наносекундах
+    больше любого из них, пока данные меняются реже раза
+    в наносекунду."""
+    return time.time_ns()
+
+
+def get_counter(key, timeout=None):
+    """Возвращает значение счетчика key, создавая отсутствующий."""
+    value = cache.get(key)
+    if value is not None:
+        return value
+    value = new_generation()
+    if cache.add(key, value, timeout):
+        return value
+    return cache.get(key, value)
+
+
+def increment(key, timeout=None):
+    """Атомарно увеличивает счетчик key, создавая отсутствующий."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, new_generation(), timeout)
+        cache.incr(key)
+
+
+def bump_generation(scope):
+    """Увеличивает счетчик поколения данных scope,
+    что делает недействительными все закешированные ответы с ним.
+    В транзакции счетчик меняется после фиксации: иначе запрос
+    между увеличением и фиксацией прочитал бы новое поколение
+    и старые строки и закешировал бы их под новым ключом."""
+    def bump():
+        increment(GENERATION_KEY.format(scope))
+        cache.set(MODIFIED_KEY.format(scope), int(time.time()), None)
+
+    transaction.on_commit(bump)
+
+
+def get_generations(scopes):
+    """Возвращает поколения данных и время последнего изменения.
+    Отсутствующий счетчик создается заново с новым начальным
+    значением."""
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    modified_keys = [MODIFIED_KEY.format(scope) for scope in scopes]
+    values = cache.get_many(keys + modified_keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        for key in missing:
+            cache.add(key, new_generation(), None)
+        values.update(cache.get_many(missing))
+    generations = tuple(values.get(key, 0) for key in keys)
+    modified = max((values.get(key, 0) for key in modified_keys), default=0)
+    return generations, modified
+
+
+def fragment_keys(prefix, objects, request, scopes=()):
+    """Возвращает ключи кеша фрагментов для объектов с полем updated_at.
+    Ключ зависит от хоста (в ответе абсолютные ссылки)
+    и поколений связанных данных scopes."""
+    generations, _ = get_generations(scopes)
+    host = request.build_absolute_uri('/')
+    return [
+        FRAGMENT_KEY.format(hashlib.md5(repr((
+            prefix, obj.pk, obj.updated_at.timestamp(), host, generations
+        )).encode()).hexdigest())
+        for obj in objects
+    ]
+
+
+class AnonymousCacheMixin:
+    """Кеширование ответов list/retrieve для анонимных пользователей.
+    Ключ строится по действию, нормализованным параметрам запроса
+    и поколениям данных cache_scopes, которые увеличиваются сигналами
+    при изменении моделей. Клиент может перепроверить ответ
+    по заголовкам ETag/Last-Modified и получить 304."""
+    cache_scopes = ()
+
+    def get_cache_scopes(self, request):
+        return self.cache_scopes
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def get_cache_key(self, request, generations):
+        params = sorted(
+            (key, sorted(request.query_params.getlist(key)))
+            for key in request.query_params
+        )
+        raw = repr((self.basename, self.action, self.kwargs.get('pk'),
+                    request.build_absolute_uri('/'), params, generations))
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return handler(request, *args, **kwargs)
+        generations, modified = get_generations(
+            self.get_cache_scopes(request))
+        key = self.get_cache_key(request, generations)
+        headers = {'ETag': f'"{key}"'}
+        if modified:
+            headers['Last-Modified'] = http_date(modified)
+        if self.not_modified(request, key, modified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers=headers)
+        data = cache.get(RESPONSE_KEY.format(key))
+        if data is not None:
+            metrics.increment('response_cache_hits')
+            return Response(data, headers=headers)
+        metrics.increment('response_cache_misses')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(RESPONSE_KEY.format(key), response.data,
+                      RESPONSE_CACHE_TIMEOUT)
+            for header, value in headers.items():
+                response[header] = value
+        return response
+
+    @staticmethod
+    def not_modified(request, key, modified):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return f'"{key}"' in if_none_match or if_none_match == '*'
+        since = parse_http_date_safe(
+            request.headers.get('If-Modified-Since', ''))
+        return bool(modified and since and modified <= since)
@@ -1,19 +1,43 @@
 from django_filters import rest_framework
+
+from api.loaders import get_user_ids
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.utils import POPULAR_ORDERING, TRENDING_ORDERING
+from recipes.search import search_recipes
 
 
 class RecipeAnonymousFilters(rest_framework.FilterSet):
-    """Фильтрация по тегу для анонимных пользователей."""
+    """Фильтрация по тегу и полнотекстовый поиск
+    для анонимных пользователей."""
 
     tags = rest_framework.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         queryset=Tag.objects.all(),
         to_field_name='slug',
     )
+    search = rest_framework.CharFilter(method='filter_search')
+    ordering = rest_framework.ChoiceFilter(
+        choices=(('popular', 'По популярности'),
+                 ('trending', 'Популярные в последнее время')),
+        method='filter_ordering')
 
     class Meta:
         model = Recipe
-        fields = ('tags',)
+        fields = ('tags', 'search', 'ordering')
+
+    def filter_search(self, queryset, name, value):
+        """Поиск по названию, ингредиентам и описанию,
+        результаты отсортированы по релевантности."""
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        """ordering=popular: сначала рецепты, чаще добавляемые
+        в избранное (индекс recipe_popular_idx).
+        ordering=trending: по активности с затуханием во времени,
+        см. recipes.trending (индекс recipe_trending_idx)."""
+        if value == 'trending':
+            return queryset.order_by(*TRENDING_ORDERING)
+        return queryset.order_by(*POPULAR_ORDERING)
 
 
 class RecipeFilters(RecipeAnonymousFilters):
@@ -33,12 +57,14 @@ class RecipeFilters(RecipeAnonymousFilters):
 
     def filter_favorited(self, queryset, name, value):
         if value:
-            return queryset.filter(recipe_in_favorites__user=self.request.user)
+            return queryset.filter(
+                id__in=get_user_ids(self.request.user, 'favorites'))
         return queryset
 
     def filter_shopping_cart(self, queryset, name, value):
         if value:
-            return queryset.filter(recipe_in_cart__user=self.request.user)
+            return queryset.filter(
+                id__in=get_user_ids(self.request.user, 'shopping_cart'))
         return queryset
 
 
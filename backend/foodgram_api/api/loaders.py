@@ -0,0 +1,87 @@
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import transaction
+
+from api import metrics
+from api.cache import get_counter, increment
+from recipes.models import Favorites, ShoppingCart
+from users.models import Subscription
+
+CONTEXT_KEY = 'user_state'
+USER_IDS_KEY = 'user_ids:{}:{}:{}'
+USER_IDS_VERSION_KEY = 'user_ids:{}:{}:version'
+USER_IDS_TIMEOUT = 10 * 60
+
+USER_IDS_QUERIES = {
+    'favorites': lambda user: Favorites.objects.filter(
+        user=user).values_list('recipe', flat=True),
+    'shopping_cart': lambda user: ShoppingCart.objects.filter(
+        user=user).values_list('recipe', flat=True),
+    'subscriptions': lambda user: Subscription.objects.filter(
+        user=user).values_list('subscription', flat=True),
+}
+
+metrics.register('user_ids_cache_hits', 'user_ids_cache_misses')
+
+
+def get_user_ids(user, kind):
+    """Возвращает отсортированный массив id избранных рецептов,
+    рецептов в корзине или авторов в подписках пользователя.
+    Массив кешируется под текущей версией, которую запись
+    увеличивает после фиксации транзакции (invalidate_user_ids).
+    Версия читается до запроса к базе, поэтому массив, прочитанный
+    до чужой записи, попадает под старую версию и больше не читается.
+    Изменения в обход invalidate_user_ids (админка, каскадное
+    удаление) видны не позже чем через USER_IDS_TIMEOUT."""
+    version = get_counter(USER_IDS_VERSION_KEY.format(user.pk, kind),
+                          USER_IDS_TIMEOUT)
+    key = USER_IDS_KEY.format(user.pk, kind, version)
+    ids = cache.get(key)
+    if ids is not None:
+        metrics.increment('user_ids_cache_hits')
+        return ids
+    metrics.increment('user_ids_cache_misses')
+    ids = array('q', sorted(USER_IDS_QUERIES[kind](user)))
+    cache.set(key, ids, USER_IDS_TIMEOUT)
+    return ids
+
+
+def contains(ids, pk):
+    index = bisect_left(ids, pk)
+    return index < len(ids) and ids[index] == pk
+
+
+def invalidate_user_ids(user, kind):
+    """Сбрасывает закешированный массив id после фиксации
+    текущей транзакции (вне транзакции - сразу)."""
+    key = USER_IDS_VERSION_KEY.format(user.pk, kind)
+    transaction.on_commit(lambda: increment(key, USER_IDS_TIMEOUT))
+
+
+class UserStateLoader:
+    """Флаги текущего пользователя в рамках одного запроса.
+    Каждый вид флагов требует не более одного обращения к кешу
+    (или к базе при промахе) на весь ответ, ответы для отдельных
+    объектов берутся из отсортированного массива id в памяти."""
+
+    def __init__(self, user):
+        self.user = user
+        self._ids = {}
+
+    def has(self, kind, pk):
+        """Возвращает флаг для объекта pk или None для анонима."""
+        if self.user.is_anonymous:
+            return None
+        if kind not in self._ids:
+            self._ids[kind] = get_user_ids(self.user, kind)
+        return contains(self._ids[kind], pk)
+
+
+def get_user_state(context):
+    """Возвращает загрузчик из контекста сериализатора,
+    создавая его при первом обращении за время запроса."""
+    if CONTEXT_KEY not in context:
+        context[CONTEXT_KEY] = UserStateLoader(context['request'].user)
+    return context[CONTEXT_KEY]
@@ -0,0 +1,189 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.utils import timezone
+
+from recipes.models import IngredientInRecipe
+
+MATCH_LIMIT = 6
+MATCH_INDEX_TTL = 60 * 60
+MATCH_SYNC_INTERVAL = 5
+MATCH_SYNC_OVERLAP = timedelta(minutes=1)
+MATCH_CHUNK_SIZE = 10000
+MATCH_MAX_CANDIDATES = 50000
+
+
+def rank_key(recipe_id, matched, size):
+    """Ключ сортировки: больше доля имеющихся ингредиентов,
+    меньше недостающих, при равенстве - новее рецепт."""
+    return -matched / size, size - matched, -recipe_id
+
+
+class RecipeMatchIndex:
+    """Процессный инвертированный индекс «ингредиент -> рецепты»
+    для подбора рецептов по продуктам в наличии.
+    Для каждого ингредиента хранится отсортированный массив id
+    рецептов, для каждого рецепта - число его ингредиентов.
+    Изменения рецептов своего процесса добавляются сразу
+    (update_recipe), чужих - по updated_at раз в sync_interval
+    секунд. Убранные из рецепта ингредиенты остаются в массивах
+    до полной перестройки раз в ttl секунд, поэтому совпадения
+    по индексу - оценка сверху, и кандидаты перепроверяются по базе."""
+
+    def __init__(self, ttl=MATCH_INDEX_TTL,
+                 sync_interval=MATCH_SYNC_INTERVAL,
+                 max_candidates=MATCH_MAX_CANDIDATES):
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self.max_candidates = max_candidates
+        self._lock = threading.Lock()
+        self._postings = None
+        self._sizes = array('H')
+        self._built_at = self._synced_at = 0
+        self._synced_until = None
+
+    def _grow(self, recipe_id):
+        if recipe_id >= len(self._sizes):
+            self._sizes.extend(
+                array('H', bytes(2 * (recipe_id + 1 - len(self._sizes)))))
+
+    def _add(self, recipe_id, ingredient_ids):
+        self._grow(recipe_id)
+        self._sizes[recipe_id] = len(ingredient_ids)
+        for ingredient_id in ingredient_ids:
+            posting = self._postings.setdefault(ingredient_id, array('q'))
+            index = bisect_left(posting, recipe_id)
+            if index == len(posting) or posting[index] != recipe_id:
+                posting.insert(index, recipe_id)
+
+    def _build(self):
+        synced_until = timezone.now()
+        self._postings, self._sizes = {}, array('H')
+        previous = None
+        # name_id, а не name: сортировка по связи подставила бы
+        # порядок рецептов по умолчанию (-pub_date), а массивы
+        # должны быть отсортированы по id для bisect.
+        pairs = IngredientInRecipe.objects.values_list(
+            'ingredient', 'name').order_by('ingredient', 'name_id')
+        for pair in pairs.iterator(chunk_size=MATCH_CHUNK_SIZE):
+            if pair == previous:
+                continue
+            ingredient_id, recipe_id = previous = pair
+            self._postings.setdefault(ingredient_id, array('q')).append(
+                recipe_id)
+            self._grow(recipe_id)
+            self._sizes[recipe_id] += 1
+        self._synced_until = synced_until
+        self._built_at = self._synced_at = time.monotonic()
+
+    def _sync(self):
+        """Добавляет рецепты, измененные в других процессах."""
+        synced_until = timezone.now()
+        changed = defaultdict(set)
+        for recipe_id, ingredient_id in IngredientInRecipe.objects.filter(
+                name__updated_at__gte=self._synced_until - MATCH_SYNC_OVERLAP
+        ).values_list('name', 'ingredient').iterator():
+            changed[recipe_id].add(ingredient_id)
+        for recipe_id, ingredient_ids in changed.items():
+            self._add(recipe_id, ingredient_ids)
+        self._synced_until = synced_until
+        self._synced_at = time.monotonic()
+
+    def _get(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._postings is None or now - self._built_at > self.ttl:
+                self._build()
+            elif now - self._synced_at > self.sync_interval:
+                self._sync()
+            return self._postings, self._sizes
+
+    def invalidate(self):
+        self._postings = None
+
+    def update_recipe(self, recipe_id, ingredient_ids):
+        with self._lock:
+            if self._postings is not None:
+                self._add(recipe_id, set(ingredient_ids))
+
+    def remove_recipe(self, recipe_id):
+        with self._lock:
+            if self._postings is not None and recipe_id < len(self._sizes):
+                self._sizes[recipe_id] = 0
+
+    def candidates(self, ingredient_ids, max_missing=None):
+        """Куча (оценка ключа, id) рецептов, в которых есть
+        хотя бы один из ингредиентов.
+        Массивы проходятся от редких ингредиентов к частым, и новых
+        рецептов набирается не больше max_candidates (самые новые
+        из массива); по массивам частых ингредиентов, которые
+        не поместились, только досчитываются совпадения уже найденных
+        рецептов. Работа ограничена max_candidates · число
+        ингредиентов запроса независимо от размера каталога; рецепты,
+        в которых есть лишь самые частые ингредиенты запроса,
+        при переполнении не рассматриваются."""
+        postings, sizes = self._get()
+        matched = Counter()
+        for posting in sorted(
+                (postings.get(ingredient_id, ())
+                 for ingredient_id in ingredient_ids), key=len):
+            head = max(
+                len(posting) - max(self.max_candidates - len(matched), 0), 0)
+            matched.update(posting[head:])
+            if head:
+                for recipe_id in list(matched):
+                    index = bisect_left(posting, recipe_id, hi=head)
+                    if index < head and posting[index] == recipe_id:
+                        matched[recipe_id] += 1
+        heap = [
+            (rank_key(recipe_id, count, sizes[recipe_id]), recipe_id)
+            for recipe_id, count in matched.items()
+            if sizes[recipe_id] and (
+                max_missing is None
+                or sizes[recipe_id] - count <= max_missing)
+        ]
+        heapq.heapify(heap)
+        return heap
+
+    @staticmethod
+    def exact(recipe_ids, ingredient_ids, max_missing=None):
+        """Точные ключи рецептов по текущему составу из базы.
+        Рецепты, в которых после изменения не осталось
+        ни одного из ингредиентов, отбрасываются."""
+        required = defaultdict(set)
+        for recipe_id, ingredient_id in IngredientInRecipe.objects.filter(
+                name__in=recipe_ids).values_list('name', 'ingredient'):
+            required[recipe_id].add(ingredient_id)
+        return [
+            (rank_key(recipe_id, len(needed & ingredient_ids), len(needed)),
+             recipe_id)
+            for recipe_id, needed in required.items()
+            if needed & ingredient_ids and (
+                max_missing is None
+                or len(needed - ingredient_ids) <= max_missing)
+        ]
+
+    def match(self, ingredient_ids, limit=MATCH_LIMIT, max_missing=None):
+        """Возвращает до limit троек (id рецепта, доля имеющихся
+        ингредиентов, число недостающих) в порядке убывания доли.
+        Кандидаты проверяются по базе пачками, пока оценка следующего
+        не станет хуже limit-го точного результата."""
+        ingredient_ids = set(ingredient_ids)
+        heap = self.candidates(ingredient_ids, max_missing)
+        best = []
+        while heap:
+            batch = [heapq.heappop(heap)[1]
+                     for _ in range(min(len(heap), 2 * limit))]
+            best = heapq.nsmallest(limit, best + self.exact(
+                batch, ingredient_ids, max_missing))
+            if len(best) == limit and heap and best[-1][0] <= heap[0][0]:
+                break
+        return [(recipe_id, -key[0], key[1]) for key, recipe_id in best]
+
+
+recipe_match_index = RecipeMatchIndex()
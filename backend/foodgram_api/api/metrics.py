@@ -0,0 +1,38 @@
+from django.core.cache import cache
+
+METRICS_KEY = 'metrics:{}'
+
+_counters = []
+
+
+def register(*names):
+    """Регистрирует счетчики, которые отдает эндпоинт метрик."""
+    for name in names:
+        if name not in _counters:
+            _counters.append(name)
+
+
+def increment(name, delta=1):
+    key = METRICS_KEY.format(name)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key, delta)
+
+
+def report():
+    """Возвращает значения счетчиков и доли попаданий
+    для пар счетчиков <name>_hits / <name>_misses."""
+    values = cache.get_many([METRICS_KEY.format(name) for name in _counters])
+    counters = {
+        name: values.get(METRICS_KEY.format(name), 0) for name in _counters
+    }
+    ratios = {}
+    for name, hits in counters.items():
+        if not name.endswith('_hits'):
+            continue
+        prefix = name[:-len('_hits')]
+        total = hits + counters.get(f'{prefix}_misses', 0)
+        ratios[f'{prefix}_hit_ratio'] = hits / total if total else None
+    return {**counters, **ratios}
@@ -0,0 +1,156 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class FeedPagination(PageNumberPagination):
+    """Пагинация лент рецептов и подписок.
+    По умолчанию постраничная (page, limit), как ждет фронтенд.
+    ?count=false отключает подсчет COUNT(*) при постраничном режиме.
+    ?cursor= включает курсорный (keyset) режим по полям ordering,
+    в котором стоимость любой страницы равна стоимости первой.
+    Порядок можно переопределить атрибутом cursor_ordering у вьюсета
+    или явным order_by по полям модели в queryset (например,
+    ordering=popular), последнее поле должно быть уникальным."""
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('-pub_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if self.cursor_query_param in request.query_params:
+            self.mode = 'cursor'
+            self.ordering = (self.queryset_ordering(queryset)
+                             or getattr(view, 'cursor_ordering',
+                                        self.ordering))
+            return self.paginate_cursor(queryset, request)
+        if request.query_params.get(self.count_query_param) == 'false':
+            self.mode = 'uncounted'
+            return self.paginate_uncounted(queryset, request)
+        self.mode = 'page'
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.mode == 'page':
+            return super().get_paginated_response(data)
+        return Response({
+            'count': None,
+            'next': self.next_link,
+            'previous': self.previous_link,
+            'results': data,
+        })
+
+    def paginate_uncounted(self, queryset, request):
+        """Постраничный режим без COUNT(*): запрашивается
+        на одну запись больше, чтобы узнать о следующей странице."""
+        try:
+            page_number = int(request.query_params.get(
+                self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if page_number < 1:
+            raise NotFound(self.invalid_page_message)
+        offset = (page_number - 1) * self.page_size
+        rows = list(queryset[offset:offset + self.page_size + 1])
+        url = request.build_absolute_uri()
+        self.next_link = (
+            replace_query_param(url, self.page_query_param, page_number + 1)
+            if len(rows) > self.page_size else None)
+        self.previous_link = None
+        if page_number == 2:
+            self.previous_link = remove_query_param(
+                url, self.page_query_param)
+        elif page_number > 2:
+            self.previous_link = replace_query_param(
+                url, self.page_query_param, page_number - 1)
+        return rows[:self.page_size]
+
+    def paginate_cursor(self, queryset, request):
+        """Курсорный режим: страница выбирается условием по значениям
+        полей ordering последней показанной записи, без OFFSET."""
+        position, reverse = self.decode_cursor(
+            queryset.model, request.query_params[self.cursor_query_param])
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.invert(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+        url = request.build_absolute_uri()
+        self.next_link = self.previous_link = None
+        if rows and (has_more if not reverse else position is not None):
+            self.next_link = self.encode_cursor(url, rows[-1], False)
+        if rows and (has_more if reverse else position is not None):
+            self.previous_link = self.encode_cursor(url, rows[0], True)
+        return rows
+
+    @staticmethod
+    def queryset_ordering(queryset):
+        """Явный порядок queryset, если он задан только полями модели
+        и заканчивается первичным ключом."""
+        ordering = tuple(queryset.query.order_by)
+        names = {field.name for field in queryset.model._meta.concrete_fields}
+        if ordering and ordering[-1] in ('id', '-id') and all(
+                isinstance(field, str) and field.lstrip('-') in names
+                for field in ordering):
+            return ordering
+        return None
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def after(ordering, position):
+        """Условие «строго после position» в порядке ordering."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, url, obj, reverse):
+        fields = [obj._meta.get_field(field.lstrip('-'))
+                  for field in self.ordering]
+        payload = {
+            'p': [field.value_to_string(obj) for field in fields],
+            'r': reverse,
+        }
+        cursor = base64.urlsafe_b64encode(
+            json.dumps(payload).encode()).decode()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, model, cursor):
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            fields = [model._meta.get_field(field.lstrip('-'))
+                      for field in self.ordering]
+            position = [field.to_python(value)
+                        for field, value in zip(fields, payload['p'])]
+            reverse = bool(payload['r'])
+        except (binascii.Error, ValueError, KeyError, TypeError,
+                ValidationError):
+            raise NotFound('Неверный курсор.')
+        if len(position) != len(fields):
+            raise NotFound('Неверный курсор.')
+        return position, reverse
@@ -0,0 +1,101 @@
+import csv
+import json
+
+from rest_framework import renderers
+
+
+class ShoppingListRenderer(renderers.BaseRenderer):
+    """Базовый рендерер списка покупок.
+    Список отдается потоком: stream() принимает итератор строк
+    (словарей с ключами name, measurement_unit, amount)
+    и возвращает генератор фрагментов ответа, astream() - то же
+    для асинхронного итератора (ASGI). Наследники определяют
+    начало и конец списка и формат одной строки."""
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Служебные ответы (ошибки) отдаются в формате JSON."""
+        return renderers.JSONRenderer().render(data)
+
+    def header(self):
+        return ''
+
+    def footer(self):
+        return ''
+
+    def format_row(self, row, first):
+        raise NotImplementedError(
+            'Метод format_row() должен быть определен.')
+
+    def stream(self, rows):
+        yield self.header()
+        for index, row in enumerate(rows):
+            yield self.format_row(row, index == 0)
+        yield self.footer()
+
+    async def astream(self, rows):
+        yield self.header()
+        first = True
+        async for row in rows:
+            yield self.format_row(row, first)
+            first = False
+        yield self.footer()
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в виде простого текста."""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def header(self):
+        return 'Список покупок:\n'
+
+    def format_row(self, row, first):
+        return (f'\n{row["name"].capitalize()} '
+                f'({row["measurement_unit"]}) — {row["amount"]}')
+
+
+class _Echo:
+    """Псевдобуфер для csv.writer: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате CSV."""
+    media_type = 'text/csv'
+    format = 'csv'
+    writer = csv.writer(_Echo())
+
+    def header(self):
+        return self.writer.writerow(('Ингредиент', 'Единицы измерения',
+                                     'Количество'))
+
+    def format_row(self, row, first):
+        return self.writer.writerow((row['name'], row['measurement_unit'],
+                                     row['amount']))
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате JSON."""
+    media_type = 'application/json'
+    format = 'json'
+
+    def header(self):
+        return '['
+
+    def footer(self):
+        return ']'
+
+    def format_row(self, row, first):
+        item = {key: row[key]
+                for key in ('name', 'measurement_unit', 'amount')}
+        return ('' if first else ',') + json.dumps(item, ensure_ascii=False)
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    JSONShoppingListRenderer,
+)
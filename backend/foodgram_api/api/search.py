@@ -0,0 +1,71 @@
+import threading
+import time
+from bisect import bisect_left
+from itertools import chain, islice
+
+from recipes.models import Ingredient
+
+INGREDIENT_SEARCH_LIMIT = 50
+INGREDIENT_INDEX_TTL = 300
+
+
+def normalize(value):
+    """Приводит строку к виду для поиска без учета регистра и буквы ё."""
+    return value.casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Процессный индекс названий ингредиентов для автодополнения.
+    Загружается лениво при первом запросе, сбрасывается сигналами
+    при изменении ингредиентов и перестраивается не реже раза в ttl
+    секунд, чтобы подхватить изменения из других процессов."""
+
+    def __init__(self, ttl=INGREDIENT_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = None
+        self._keys = None
+        self._loaded_at = 0
+
+    def invalidate(self):
+        self._entries = None
+
+    def _get(self):
+        with self._lock:
+            expired = time.monotonic() - self._loaded_at > self.ttl
+            if self._entries is None or expired:
+                self._entries = sorted(
+                    (normalize(name), pk, name, measurement_unit)
+                    for pk, name, measurement_unit
+                    in Ingredient.objects.values_list(
+                        'pk', 'name', 'measurement_unit').iterator()
+                )
+                self._keys = [entry[0] for entry in self._entries]
+                self._loaded_at = time.monotonic()
+            return self._entries, self._keys
+
+    def search(self, query, measurement_unit=None,
+               limit=INGREDIENT_SEARCH_LIMIT):
+        """Возвращает не более limit ингредиентов: сначала названия,
+        начинающиеся с query, затем содержащие его."""
+        entries, keys = self._get()
+        query = normalize(query)
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + '\U0010ffff', lo=start)
+        prefixed = islice(entries, start, end)
+        contained = (
+            entry for entry in chain(islice(entries, start),
+                                     islice(entries, end, None))
+            if query in entry[0]
+        )
+        return [
+            {'id': pk, 'name': name, 'measurement_unit': unit}
+            for _, pk, name, unit in islice(
+                (entry for entry in chain(prefixed, contained)
+                 if measurement_unit is None
+                 or entry[3] == measurement_unit),
+                limit)
+        ]
+
+
+ingredient_index = IngredientIndex()
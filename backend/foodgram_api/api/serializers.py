@@ -1,26 +1,85 @@
 import base64
+import binascii
+from tempfile import SpooledTemporaryFile
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.db import models, transaction
 
 from rest_framework import serializers
 
+from api import metrics
+from api.bulk import BULK_MAX_ITEMS
+from api.cache import FRAGMENT_CACHE_TIMEOUT, fragment_keys
+from api.loaders import get_user_state
 from api.utils import create_update_ing
-from recipes.models import (Favorites, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag)
-from users.models import CustomUser, Subscription
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+from users.models import CustomUser
+
+
+BASE64_CHUNK_SIZE = 64 * 1024
 
 
 class Base64ImageField(serializers.ImageField):
-    """Кастомный тип поля для декодирования изображения."""
+    """Кастомный тип поля для декодирования изображения.
+    Строка декодируется частями во временный файл (на диске,
+    если он больше FILE_UPLOAD_MAX_MEMORY_SIZE), слишком большие
+    изображения отклоняются до декодирования.
+    Уменьшенные копии строятся в фоне (recipes/images.py)."""
+    default_error_messages = {
+        **serializers.ImageField.default_error_messages,
+        'too_large': 'Размер изображения превышает {max_size} байт.',
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-
+            data = self.decode(data)
         return super().to_internal_value(data)
 
+    def decode(self, data):
+        format, _, imgstr = data.partition(';base64,')
+        ext = format.split('/')[-1]
+        # Переносы строк и пробелы допустимы в base64, но validate=True
+        # их отвергает, а части по 4 символа сдвигались бы.
+        imgstr = ''.join(imgstr.split())
+        max_size = settings.MAX_IMAGE_UPLOAD_SIZE
+        if len(imgstr) // 4 * 3 > max_size:
+            self.fail('too_large', max_size=max_size)
+        file = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        try:
+            for start in range(0, len(imgstr), BASE64_CHUNK_SIZE):
+                file.write(base64.b64decode(
+                    imgstr[start:start + BASE64_CHUNK_SIZE], validate=True))
+        except binascii.Error:
+            file.close()
+            self.fail('invalid_image')
+        file.seek(0)
+        return File(file, name='temp.' + ext)
+
+
+class RenditionImageField(serializers.ReadOnlyField):
+    """Ссылка на уменьшенную копию изображения рецепта.
+    Пока копия не построена, отдается ссылка на оригинал."""
+
+    def __init__(self, rendition, **kwargs):
+        self.rendition = rendition
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        renditions = recipe.image_renditions
+        rendition = (renditions.get(self.rendition)
+                     if renditions.get('source') == recipe.image.name
+                     else None)
+        url = (recipe.image.storage.url(rendition) if rendition
+               else recipe.image.url)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
 
 class UserSerializer(serializers.ModelSerializer):
     """Сериализатор модели пользователя."""
@@ -32,9 +91,7 @@ class UserSerializer(serializers.ModelSerializer):
                   'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if not user.is_anonymous:
-            return user.follower.filter(subscription=obj).exists()
+        return get_user_state(self.context).has('subscriptions', obj.pk)
 
 
 class AuthUserSerializer(serializers.ModelSerializer):
@@ -82,13 +139,41 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+class IngredientAmountSerializer(serializers.Serializer):
+    """Ингредиент в запросе на создание или изменение рецепта.
+    Существование id проверяется одним запросом для всего списка
+    в RecipeCreateUpdateSerializer.validate_ingredients."""
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массовых операций."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=BULK_MAX_ITEMS)
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов: фрагменты всех рецептов страницы
+    запрашиваются из кеша одним обращением."""
+
+    def to_representation(self, data):
+        if isinstance(data, models.manager.BaseManager):
+            data = data.all()
+        return self.child.to_representation_many(list(data), 'card')
+
+
 class RecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор модели рецепта."""
+    """Сериализатор модели рецепта.
+    Общая для всех пользователей часть ответа кешируется по id
+    и дате изменения рецепта, флаги пользователя подставляются
+    при каждом запросе."""
     tags = TagSerializer(read_only=True, many=True)
     author = UserSerializer(read_only=True)
     ingredients = IngredientInRecipeSerializer(
         read_only=True, many=True, source='recipes')
-    image = Base64ImageField()
+    image = RenditionImageField('full')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -97,23 +182,58 @@ class RecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
                   'is_in_shopping_cart', 'name', 'image', 'text',
                   'cooking_time')
+        list_serializer_class = RecipeListSerializer
+
+    def to_representation(self, instance):
+        return self.to_representation_many([instance], 'full')[0]
+
+    def to_representation_many(self, recipes, rendition):
+        """Собирает ответы для списка рецептов из кешированных
+        фрагментов, недостающие фрагменты сериализует и кеширует.
+        rendition - вариант изображения: card в списке, full в рецепте."""
+        self.fields['image'].rendition = rendition
+        keys = fragment_keys(
+            f'recipe:{rendition}', recipes, self.context['request'],
+            scopes=('tags', 'users', 'ingredients'))
+        fragments = cache.get_many(keys)
+        missing = {}
+        result = []
+        for recipe, key in zip(recipes, keys):
+            fragment = fragments.get(key)
+            if fragment is None:
+                fragment = super().to_representation(recipe)
+                missing[key] = fragment
+            result.append(self.with_user_state(recipe, fragment))
+        if missing:
+            cache.set_many(missing, FRAGMENT_CACHE_TIMEOUT)
+        metrics.increment('fragment_cache_hits', len(recipes) - len(missing))
+        metrics.increment('fragment_cache_misses', len(missing))
+        return result
+
+    def with_user_state(self, recipe, fragment):
+        """Подставляет во фрагмент флаги текущего пользователя."""
+        data = fragment.copy()
+        data['author'] = {
+            **fragment['author'],
+            'is_subscribed': self.fields['author'].get_is_subscribed(
+                recipe.author),
+        }
+        data['is_favorited'] = self.get_is_favorited(recipe)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(recipe)
+        return data
 
     def get_is_favorited(self, obj):
         """Метод проверяет наличие рецепта в избранном."""
-        user = self.context['request'].user
-        if not user.is_anonymous:
-            return Favorites.objects.filter(user=user, recipe=obj).exists()
+        return get_user_state(self.context).has('favorites', obj.pk)
 
     def get_is_in_shopping_cart(self, obj):
         """Метод проверяет наличие рецепта в корзине."""
-        user = self.context['request'].user
-        if not user.is_anonymous:
-            return ShoppingCart.objects.filter(user=user, recipe=obj).exists()
+        return get_user_state(self.context).has('shopping_cart', obj.pk)
 
 
 class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
-    """Сериализатор для создания рецепта."""
-    ingredients = IngredientInRecipeSerializer(many=True)
+    """Сериализатор для создания и изменения рецепта."""
+    ingredients = IngredientAmountSerializer(many=True)
     image = Base64ImageField()
 
     class Meta:
@@ -121,6 +241,26 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         fields = ('ingredients', 'tags', 'image',
                   'name', 'text', 'cooking_time')
 
+    def validate_ingredients(self, value):
+        """Объединяет повторы ингредиентов, суммируя количество,
+        и проверяет существование всех id одним запросом.
+        Найденные id запоминаются в контексте, поэтому при массовом
+        создании рецептов запрашиваются только новые.
+        Возвращает словарь {id ингредиента: количество}."""
+        amounts = {}
+        for item in value:
+            amounts[item['id']] = amounts.get(item['id'], 0) + item['amount']
+        known = self.context.setdefault('known_ingredients', set())
+        unknown = amounts.keys() - known
+        if unknown:
+            known.update(Ingredient.objects.in_bulk(unknown))
+        missing = amounts.keys() - known
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {sorted(missing)}.')
+        return amounts
+
+    @transaction.atomic
     def create(self, validated_data):
         """Метод создания рецепта."""
         request = self.context['request']
@@ -131,14 +271,15 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         create_update_ing(ingredients, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        """Метод обновления рецепта."""
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        create_update_ing(ingredients, instance)
-        instance.save()
+        """Метод обновления рецепта. Поля и теги сохраняет
+        ModelSerializer.update, ингредиенты - create_update_ing
+        по разнице с текущими, все в одной транзакции."""
+        ingredients = validated_data.pop('ingredients', None)
+        instance = super().update(instance, validated_data)
+        if ingredients is not None:
+            create_update_ing(ingredients, instance)
         return instance
 
     def to_representation(self, instance):
@@ -149,26 +290,18 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
 
 class RecipeMinifiedSerializer(serializers.ModelSerializer):
     """Сериализатор уменьшенного рецепта."""
+    image = RenditionImageField('thumbnail')
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
 
-    def validate(self, data):
-        user = self.context['request'].user
-        favorites = self.context['favorites']
-        if Favorites.objects.filter(user=user, recipe=favorites).exists():
-            raise serializers.ValidationError(
-                'Этот рецепт уже есть в избранном.'
-            )
-        return data
-
 
 class SubscriptionSerializer(serializers.ModelSerializer):
     """Сериализатор модели подписки."""
     is_subscribed = serializers.SerializerMethodField()
-    recipes = RecipeMinifiedSerializer(many=True, read_only=True)
+    recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
 
     class Meta:
@@ -186,33 +319,34 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Вы не можете подписаться на самого себя.'
             )
-        if Subscription.objects.filter(user=user,
-                                       subscription=subscription).exists():
-            raise serializers.ValidationError(
-                'Вы уже подписаны на данного пользователя.'
-            )
         return data
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        return user.follower.filter(subscription=obj).exists()
+        return get_user_state(self.context).has('subscriptions', obj.pk)
+
+    def get_recipes(self, obj):
+        """Метод возвращает рецепты автора с учетом recipes_limit."""
+        if hasattr(obj, 'recipes_preview'):
+            recipes = obj.recipes_preview
+        else:
+            recipes = obj.recipes.all()
+            recipes_limit = self.context.get('recipes_limit')
+            if recipes_limit:
+                recipes = recipes[:recipes_limit]
+        return RecipeMinifiedSerializer(
+            recipes, many=True, context=self.context).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
 
 class ShoppingCartSerializer(serializers.ModelSerializer):
     """Сериализатор модели корзины покупок."""
+    image = RenditionImageField('thumbnail')
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
-
-    def validate(self, data):
-        user = self.context['request'].user
-        products = self.context['products']
-        if ShoppingCart.objects.filter(user=user, recipe=products).exists():
-            raise serializers.ValidationError(
-                'Этот рецепт уже есть в списке покупок.'
-            )
-        return data
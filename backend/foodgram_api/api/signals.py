@@ -0,0 +1,75 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import invalidate_tokens
+from api.cache import bump_generation
+from api.matching import recipe_match_index
+from api.search import ingredient_index
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+from recipes.utils import popularity_changed
+from users.models import CustomUser
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    """Сбрасывает индекс автодополнения при изменении ингредиентов."""
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipes_generation(sender, **kwargs):
+    bump_generation('recipes')
+
+
+@receiver(popularity_changed)
+def bump_popularity_generation(sender, **kwargs):
+    bump_generation('popularity')
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_match_index(sender, instance, **kwargs):
+    recipe_match_index.remove_recipe(instance.pk)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_generation(sender, **kwargs):
+    bump_generation('ingredients')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_generation(sender, **kwargs):
+    bump_generation('tags')
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def bump_users_generation(sender, update_fields=None, **kwargs):
+    """Вход пользователя обновляет только last_login,
+    это не влияет на закешированные ответы."""
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    bump_generation('users')
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Выход (djoser token/logout) удаляет токен из кешей."""
+    invalidate_tokens((instance.key,))
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_tokens(sender, instance, update_fields=None, **kwargs):
+    """Смена пароля, деактивация и другие изменения пользователя
+    сбрасывают закешированные вместе с токеном данные."""
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    invalidate_tokens(Token.objects.filter(user=instance).values_list(
+        'key', flat=True))
@@ -0,0 +1,949 @@
+import json
+import os
+import tempfile
+from array import array
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.async_views import IngredientAsyncView, TagAsyncView
+from api.authentication import local_tokens
+from api.cache import (GENERATION_KEY, bump_generation, get_counter,
+                       get_generations)
+from api.loaders import USER_IDS_KEY, USER_IDS_VERSION_KEY, get_user_ids
+from api.matching import RecipeMatchIndex, recipe_match_index
+from api.search import ingredient_index
+from recipes import timelines
+from recipes.images import recipe_files
+from recipes.models import (EngagementBucket, Favorites, Ingredient,
+                            IngredientInRecipe, Recipe, RecipeNeighbor,
+                            ShoppingCart, ShoppingListItem, StoredFile, Tag,
+                            TimelineEntry)
+from recipes.trending import rollup
+from recipes.utils import build_shopping_lists, stored_shopping_lists
+from users.models import CustomUser
+
+IMAGE = 'recipes/images/test.png'
+PNG = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAQMAAAAl21bK'
+       'AAAAA1BMVEUAAACnej3aAAAAAXRSTlMAQObYZgAAAApJREFUCNdjYAAAAAIAAeIhvDMA'
+       'AAAASUVORK5CYII=')
+
+
+class APITestCase(TestCase):
+    """Общие данные: два автора, теги, ингредиенты и рецепты."""
+    recipes_count = 40
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='user', email='user@example.com', password='pass')
+        cls.author = CustomUser.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {i}', color=f'#00000{i}',
+                               slug=f'tag{i}')
+            for i in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(6)
+        ]
+        cls.recipes = []
+        for i in range(cls.recipes_count):
+            recipe = Recipe.objects.create(
+                author=cls.author if i % 2 else cls.user,
+                name=f'Рецепт {i}', image=IMAGE,
+                image_renditions={'source': IMAGE},
+                text='Описание', cooking_time=10)
+            recipe.tags.set(cls.tags[:2])
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(name=recipe, ingredient=ingredient,
+                                   amount=10)
+                for ingredient in cls.ingredients[i % 3:i % 3 + 3])
+            cls.recipes.append(recipe)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.guest = APIClient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+
+class RecipeListQueriesTest(APITestCase):
+    """Число запросов списка рецептов не зависит от размера страницы.
+    Холодный запрос: COUNT, рецепты, теги и ингредиенты (prefetch),
+    для пользователя еще по запросу на массивы id избранного, корзины
+    и подписок. Повторный анонимный ответ берется из кеша целиком,
+    пользовательский - из кеша фрагментов и массивов id."""
+
+    def assert_queries(self, client, cold, warm):
+        for limit in (6, 30):
+            cache.clear()
+            with self.assertNumQueries(cold):
+                response = client.get(f'/api/recipes/?limit={limit}')
+            self.assertEqual(len(response.json()['results']), limit)
+            with self.assertNumQueries(warm):
+                client.get(f'/api/recipes/?limit={limit}')
+
+    def test_anonymous(self):
+        self.assert_queries(self.guest, cold=4, warm=0)
+
+    def test_authenticated(self):
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/favorite/')
+        self.assert_queries(self.client, cold=7, warm=4)
+        response = self.client.get('/api/recipes/?limit=40')
+        flags = {item['id']: item['is_favorited']
+                 for item in response.json()['results']}
+        self.assertTrue(flags.pop(self.recipes[0].pk))
+        self.assertFalse(any(flags.values()))
+
+
+class FeedPaginationTest(APITestCase):
+    """Курсорный и постраничный без COUNT режимы пагинации."""
+
+    def walk(self, url):
+        pages = []
+        while url:
+            data = self.guest.get(url).json()
+            pages.append([item['id'] for item in data['results']])
+            url = data['next']
+        return pages
+
+    def test_cursor_walks_all_recipes_in_order(self):
+        pages = self.walk('/api/recipes/?cursor=&limit=6')
+        expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+        self.assertEqual(sum(pages, []), expected)
+        self.assertTrue(all(len(page) == 6 for page in pages[:-1]))
+
+    def test_cursor_previous_returns_previous_page(self):
+        first = self.guest.get('/api/recipes/?cursor=&limit=6').json()
+        self.assertIsNone(first['previous'])
+        second = self.guest.get(first['next']).json()
+        previous = self.guest.get(second['previous']).json()
+        self.assertEqual([item['id'] for item in previous['results']],
+                         [item['id'] for item in first['results']])
+
+    def test_cursor_with_popular_ordering(self):
+        for count, recipe in enumerate(self.recipes[:5]):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                favorites_count=count + 1)
+        pages = self.walk('/api/recipes/?ordering=popular&cursor=&limit=4')
+        expected = list(Recipe.objects.order_by(
+            '-favorites_count', '-pub_date', '-id').values_list(
+            'id', flat=True))
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_invalid_cursor(self):
+        response = self.guest.get('/api/recipes/?cursor=broken')
+        self.assertEqual(response.status_code, 404)
+
+    def test_uncounted_pages(self):
+        data = self.guest.get('/api/recipes/?count=false&limit=30').json()
+        self.assertIsNone(data['count'])
+        self.assertEqual(len(data['results']), 30)
+        last = self.guest.get(data['next']).json()
+        self.assertEqual(len(last['results']), self.recipes_count - 30)
+        self.assertIsNone(last['next'])
+
+
+class SubscriptionsQueriesTest(APITestCase):
+    """Список подписок: превью рецептов ограничено recipes_limit,
+    число запросов не зависит от числа авторов и их рецептов:
+    COUNT, авторы с аннотацией recipes_count и превью рецептов
+    одним запросом с оконной функцией."""
+
+    def get_subscriptions(self, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(
+                '/api/users/subscriptions/?recipes_limit=2&limit=6')
+        return response.json()['results']
+
+    def test_queries(self):
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        expected = list(Recipe.objects.filter(author=self.author).order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+        [data] = self.get_subscriptions(3)
+        self.assertEqual([recipe['id'] for recipe in data['recipes']],
+                         expected[:2])
+        self.assertEqual(data['recipes_count'], len(expected))
+        self.assertTrue(data['is_subscribed'])
+        for i in range(5):
+            author = CustomUser.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com')
+            Recipe.objects.bulk_create(
+                Recipe(author=author, name=f'Рецепт {i}.{j}', image=IMAGE,
+                       text='Описание', cooking_time=10)
+                for j in range(i + 1))
+            self.client.post(f'/api/users/{author.pk}/subscribe/')
+        data = self.get_subscriptions(3)
+        self.assertEqual([item['recipes_count'] for item in data],
+                         [len(expected), 1, 2, 3, 4, 5])
+        self.assertEqual([len(item['recipes']) for item in data],
+                         [2, 1, 2, 2, 2, 2])
+
+
+class SubscriptionFeedTest(APITestCase):
+    """Лента подписок читается из записей ленты в порядке рецептов."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        self.expected = list(Recipe.objects.filter(
+            author=self.author).order_by('-pub_date', '-id').values_list(
+            'id', flat=True))
+
+    def walk(self, url):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids += [item['id'] for item in data['results']]
+            url = data['next']
+        return ids
+
+    def test_pages_and_cursor(self):
+        self.assertEqual(self.walk('/api/recipes/feed/?limit=6'),
+                         self.expected)
+        self.assertEqual(self.walk('/api/recipes/feed/?cursor=&limit=6'),
+                         self.expected)
+
+    def test_cursor_with_equal_pub_dates(self):
+        TimelineEntry.objects.filter(user=self.user).update(
+            pub_date=timezone.now())
+        ids = self.walk('/api/recipes/feed/?cursor=&limit=4')
+        self.assertEqual(sorted(ids, reverse=True), ids)
+        self.assertEqual(sorted(ids), sorted(self.expected))
+
+    def test_feed_query_uses_timeline_only(self):
+        sql = str(timelines.feed(self.user, set()).query)
+        self.assertNotIn('recipes_recipe', sql)
+
+    @mock.patch.object(timelines, 'PULL_THRESHOLD', 0)
+    def test_pulled_author(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Новый', image=IMAGE,
+            image_renditions={'source': IMAGE}, text='Описание',
+            cooking_time=5)
+        self.assertEqual(self.walk('/api/recipes/feed/?cursor=&limit=6'),
+                         [recipe.pk] + self.expected)
+
+
+class ShoppingListTest(APITestCase):
+    """Сводный список покупок совпадает с пересчетом по корзине
+    после каждой операции, меняющей корзину или ингредиенты."""
+
+    def assert_consistent(self):
+        self.assertEqual(stored_shopping_lists(), build_shopping_lists())
+
+    def test_cart_and_recipe_changes(self):
+        first, second = self.recipes[0], self.recipes[2]
+        for recipe in (first, second):
+            self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assert_consistent()
+        self.assertEqual(
+            stored_shopping_lists()[self.user.pk][self.ingredients[2].pk],
+            20)
+        response = self.client.patch(
+            f'/api/recipes/{first.pk}/', {'ingredients': [
+                {'id': self.ingredients[0].pk, 'amount': 5},
+                {'id': self.ingredients[5].pk, 'amount': 7},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_consistent()
+        self.client.delete(f'/api/recipes/{second.pk}/shopping_cart/')
+        self.assert_consistent()
+        self.client.delete(f'/api/recipes/{first.pk}/')
+        self.assert_consistent()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_admin_changes(self):
+        recipe = self.recipes[1]
+        cart_admin = admin.site._registry[ShoppingCart]
+        cart = ShoppingCart(user=self.user, recipe=recipe)
+        cart_admin.save_model(None, cart, None, False)
+        self.assert_consistent()
+        amounts_admin = admin.site._registry[IngredientInRecipe]
+        item = IngredientInRecipe.objects.filter(name=recipe).first()
+        item.amount = 100
+        amounts_admin.save_model(None, item, None, True)
+        self.assert_consistent()
+        amounts_admin.delete_model(None, item)
+        self.assert_consistent()
+        cart_admin.delete_queryset(
+            None, ShoppingCart.objects.filter(pk=cart.pk))
+        self.assert_consistent()
+        self.assertFalse(ShoppingListItem.objects.exists())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.in_carts_count, 0)
+
+    def test_admin_favorites_counter(self):
+        first, second = self.recipes[1], self.recipes[3]
+        favorites_admin = admin.site._registry[Favorites]
+        favorite = Favorites(user=self.user, recipe=first)
+        favorites_admin.save_model(None, favorite, None, False)
+        favorite.recipe = second
+        favorites_admin.save_model(None, favorite, None, True)
+        self.assertEqual(
+            [Recipe.objects.get(pk=recipe.pk).favorites_count
+             for recipe in (first, second)], [0, 1])
+        favorites_admin.delete_queryset(
+            None, Favorites.objects.filter(pk=favorite.pk))
+        self.assertEqual(Recipe.objects.get(pk=second.pk).favorites_count, 0)
+
+
+class RecipeMatchTest(APITestCase):
+    """Подбор рецептов по индексу совпадает с точным ранжированием
+    и учитывает изменения и удаление рецептов."""
+
+    def setUp(self):
+        super().setUp()
+        recipe_match_index.invalidate()
+
+    def match(self, ingredients, **params):
+        ids = ','.join(str(self.ingredients[i].pk) for i in ingredients)
+        query = ''.join(f'&{key}={value}' for key, value in params.items())
+        return self.guest.get(
+            f'/api/recipes/match/?ingredients={ids}{query}').json()
+
+    def test_ranking(self):
+        data = self.match((0, 1, 2), limit=20)
+        full = sorted((recipe.pk for recipe in self.recipes[::3]),
+                      reverse=True)
+        self.assertEqual([item['id'] for item in data[:len(full)]], full)
+        self.assertTrue(all(item['coverage'] == 1 and item['missing'] == 0
+                            for item in data[:len(full)]))
+        partial = data[len(full):]
+        self.assertTrue(all(item['missing'] == 1 for item in partial))
+        self.assertEqual(len(data), 20)
+
+    def test_max_missing(self):
+        data = self.match((0,), limit=40, max_missing=0)
+        self.assertEqual(data, [])
+        data = self.match((0,), limit=40, max_missing=2)
+        self.assertEqual(len(data), len(self.recipes[::3]))
+
+    def test_follows_recipe_changes(self):
+        recipe = self.recipes[0]
+        self.match((0, 1, 2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f'/api/recipes/{recipe.pk}/', {'ingredients': [
+                    {'id': self.ingredients[5].pk, 'amount': 1},
+                ]}, format='json')
+        data = self.match((5,), limit=40, max_missing=0)
+        self.assertEqual([item['id'] for item in data], [recipe.pk])
+        ids = [item['id'] for item in self.match((0, 1, 2), limit=40)]
+        self.assertNotIn(recipe.pk, ids)
+        response = self.client.delete(f'/api/recipes/{self.recipes[6].pk}/')
+        self.assertEqual(response.status_code, 204)
+        ids = [item['id'] for item in self.match((0, 1, 2), limit=40)]
+        self.assertNotIn(self.recipes[6].pk, ids)
+
+    def test_follows_admin_changes(self):
+        recipe = self.recipes[0]
+        self.match((0, 1, 2))
+        amounts_admin = admin.site._registry[IngredientInRecipe]
+        rows = IngredientInRecipe.objects.filter(name=recipe)
+        item = rows.get(ingredient=self.ingredients[0])
+        item.ingredient = self.ingredients[5]
+        with self.captureOnCommitCallbacks(execute=True):
+            amounts_admin.save_model(None, item, None, True)
+            amounts_admin.delete_queryset(
+                None, rows.exclude(ingredient=self.ingredients[5]))
+        data = self.match((5,), limit=40, max_missing=0)
+        self.assertEqual([item['id'] for item in data], [recipe.pk])
+        self.assertGreater(Recipe.objects.get(pk=recipe.pk).updated_at,
+                           recipe.updated_at)
+
+    def test_database_wins(self):
+        recipe = self.recipes[0]
+        self.match((0, 1, 2))
+        # Состав изменен в обход update_recipe и без updated_at:
+        # индекс по-прежнему считает рецепт полным совпадением.
+        IngredientInRecipe.objects.filter(
+            name=recipe, ingredient=self.ingredients[0]
+        ).update(ingredient=self.ingredients[5])
+        with mock.patch.object(recipe_match_index, 'sync_interval', 3600):
+            data = {item['id']: item
+                    for item in self.match((0, 1, 2), limit=40)}
+        self.assertEqual(data[recipe.pk]['missing'], 1)
+        self.assertEqual(data[recipe.pk]['coverage'], round(2 / 3, 4))
+
+    def test_candidates_cap(self):
+        index = RecipeMatchIndex(max_candidates=5)
+        heap = index.candidates({self.ingredients[0].pk,
+                                 self.ingredients[2].pk})
+        newest = sorted(recipe.pk for recipe in self.recipes[::3])[-5:]
+        self.assertEqual(sorted(recipe_id for _, recipe_id in heap), newest)
+        self.assertTrue(all(key[0] == -2 / 3 for key, _ in heap))
+
+
+class IngredientSearchTest(APITestCase):
+    """Поиск ингредиентов по индексу в памяти: сначала совпадения
+    с начала названия, без учета буквы ё, не больше 50 результатов."""
+
+    def setUp(self):
+        super().setUp()
+        ingredient_index.invalidate()
+
+    def search(self, name):
+        return [item['name'] for item in self.guest.get(
+            '/api/ingredients/', {'name': name}).json()]
+
+    def test_prefix_before_substring(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('ржаная мука', 'мука', 'мука пшеничная'))
+        self.assertEqual(self.search('Мук'),
+                         ['мука', 'мука пшеничная', 'ржаная мука'])
+
+    def test_yo_normalization(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('ёжевика', 'свёкла'))
+        self.assertEqual(self.search('еж'), ['ёжевика'])
+        self.assertEqual(self.search('свек'), ['свёкла'])
+        self.assertEqual(self.search('ЁЖ'), ['ёжевика'])
+
+    def test_limit(self):
+        self.assertEqual(len(self.search('ингредиент')), 6)
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'соль {i:02}', measurement_unit='г')
+            for i in range(60))
+        ingredient_index.invalidate()
+        names = self.search('соль')
+        self.assertEqual(len(names), 50)
+        self.assertEqual(names, [f'соль {i:02}' for i in range(50)])
+
+    def test_follows_ingredient_save(self):
+        self.assertEqual(self.search('перец'), [])
+        ingredient = self.ingredients[0]
+        ingredient.name = 'перец черный'
+        ingredient.save()
+        self.assertEqual(self.search('перец'), ['перец черный'])
+        ingredient.delete()
+        self.assertEqual(self.search('перец'), [])
+
+
+class IngredientLoaderTest(TestCase):
+    """Загрузка ингредиентов из CSV и JSON пропускает дубликаты
+    и при повторном запуске ничего не добавляет."""
+
+    def load(self, name, content):
+        path = os.path.join(tempfile.mkdtemp(), name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        output = StringIO()
+        call_command('ingredients', path, batch_size=2, stdout=output)
+        return output.getvalue()
+
+    def test_csv_and_json(self):
+        output = self.load('ingredients.csv', (
+            'мука,г\nсоль,г\nмука,г\n\nмука,кг\nсоль,г\n'))
+        self.assertIn('3 new of 5 rows', output)
+        items = [{'name': name, 'measurement_unit': unit} for name, unit in (
+            ('соль', 'г'), ('яйца', 'шт'), ('яйца', 'шт'), ('сахар', 'г'))]
+        with mock.patch(
+                'recipes.management.commands.ingredients.READ_CHUNK_SIZE',
+                16):
+            output = self.load('ingredients.json', json.dumps(
+                items, ensure_ascii=False))
+        self.assertIn('2 new of 4 rows', output)
+        self.assertEqual(Ingredient.objects.count(), 5)
+        self.assertIn('0 new of 5 rows', self.load('ingredients.csv', (
+            'мука,г\nсоль,г\nмука,кг\nяйца,шт\nсахар,г\n')))
+        self.assertEqual(Ingredient.objects.count(), 5)
+
+
+class RecipeSearchTest(APITestCase):
+    """Полнотекстовый поиск: название важнее описания, слова
+    ищутся по префиксу, векторы следуют за изменениями рецептов
+    и ингредиентов, поиск сочетается с фильтрами."""
+
+    def search(self, client, query):
+        data = client.get(f'/api/recipes/?limit=40&{query}').json()
+        return [item['id'] for item in data['results']]
+
+    def test_ranking(self):
+        by_text, by_name = self.recipes[2], self.recipes[1]
+        by_text.text = 'Сварить суп'
+        by_text.save()
+        by_name.name = 'Суп с курицей'
+        by_name.save()
+        self.assertEqual(self.search(self.guest, 'search=суп'),
+                         [by_name.pk, by_text.pk])
+        self.assertEqual(self.search(self.client, 'search=кур'),
+                         [by_name.pk])
+        self.assertEqual(self.search(self.guest, 'search=суп&tags=tag0'),
+                         [by_name.pk, by_text.pk])
+        self.assertEqual(self.search(self.guest, 'search=суп&tags=tag2'),
+                         [])
+        self.assertEqual(self.search(self.guest, 'search=!!'), [])
+
+    def test_follows_ingredient_rename(self):
+        self.assertEqual(self.search(self.guest, 'search=шафран'), [])
+        ingredient = self.ingredients[0]
+        ingredient.name = 'шафран'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertEqual(
+            sorted(self.search(self.guest, 'search=шафран')),
+            sorted(recipe.pk for recipe in self.recipes[::3]))
+
+
+class TrendingRollupTest(APITestCase):
+    """Свертка активности по часам: вклад событий затухает
+    со временем, повторный запуск не учитывает часы дважды,
+    список ordering=trending сбрасывается после свертки."""
+
+    def add(self, model, user, recipe, created_at):
+        model.objects.create(user=user, recipe=recipe)
+        model.objects.filter(user=user, recipe=recipe).update(
+            created_at=created_at)
+
+    def rollup(self, now):
+        with self.captureOnCommitCallbacks(execute=True):
+            return rollup(now)
+
+    def trending(self):
+        response = self.guest.get('/api/recipes/?ordering=trending&limit=3')
+        return [item['id'] for item in response.json()['results']]
+
+    def test_rollup(self):
+        now = timezone.now().replace(minute=30, second=0, microsecond=0)
+        older, newer, cart = self.recipes[3], self.recipes[4], self.recipes[5]
+        for user in (self.user, self.author):
+            self.add(Favorites, user, older, now - timedelta(hours=30))
+        self.add(Favorites, self.user, newer, now - timedelta(hours=2))
+        self.add(ShoppingCart, self.author, cart, now - timedelta(hours=2))
+        self.assertEqual(self.rollup(now), 3)
+        self.assertEqual(self.rollup(now), 0)
+        self.assertEqual(
+            EngagementBucket.objects.get(recipe=older).favorites, 2)
+        # Одно свежее добавление важнее двух, сделанных 30 часов назад,
+        # корзина весит вдвое меньше избранного.
+        self.assertEqual(self.trending(), [newer.pk, older.pk, cart.pk])
+        for user in (self.user, self.author):
+            self.add(Favorites, user, cart, now + timedelta(minutes=30))
+        self.assertEqual(self.rollup(now + timedelta(hours=2)), 1)
+        self.assertEqual(self.trending(), [cart.pk, newer.pk, older.pk])
+
+
+class RecipeUpdateTest(APITestCase):
+    """Изменение рецепта: состав обновляется по разнице с текущими
+    строками, повторы ингредиентов в запросе объединяются."""
+
+    def rows(self, recipe):
+        return {row.ingredient_id: (row.pk, row.amount)
+                for row in IngredientInRecipe.objects.filter(name=recipe)}
+
+    def patch(self, recipe, data):
+        return self.client.patch(
+            f'/api/recipes/{recipe.pk}/', data, format='json')
+
+    def test_only_tags(self):
+        recipe = self.recipes[0]
+        rows = self.rows(recipe)
+        response = self.patch(recipe, {'tags': [self.tags[2].pk]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([tag['id'] for tag in response.json()['tags']],
+                         [self.tags[2].pk])
+        self.assertEqual(self.rows(recipe), rows)
+
+    def test_merge_duplicates(self):
+        recipe = self.recipes[0]
+        first, second = self.ingredients[:2]
+        rows = self.rows(recipe)
+        response = self.patch(recipe, {'ingredients': [
+            {'id': first.pk, 'amount': 5},
+            {'id': second.pk, 'amount': 10},
+            {'id': first.pk, 'amount': 7},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        # Строки меняются на месте, а не удаляются и создаются заново.
+        self.assertEqual(self.rows(recipe), {
+            first.pk: (rows[first.pk][0], 12),
+            second.pk: rows[second.pk],
+        })
+
+    def test_unknown_ingredient(self):
+        recipe = self.recipes[0]
+        rows = self.rows(recipe)
+        response = self.patch(recipe, {'ingredients': [
+            {'id': self.ingredients[0].pk, 'amount': 5},
+            {'id': 0, 'amount': 1},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ingredients', response.json())
+        self.assertEqual(self.rows(recipe), rows)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_PIPELINE_EAGER=True)
+class BulkEndpointsTest(APITestCase):
+    """Массовые операции возвращают статус по каждому id,
+    счетчики и список покупок совпадают с пересчетом."""
+
+    def statuses(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [(item['id'], item['status']) for item in response.json()]
+
+    def counters(self, field):
+        return list(Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in self.recipes[:3]]
+        ).order_by('id').values_list(field, flat=True))
+
+    def test_favorites(self):
+        first, second, third = (recipe.pk for recipe in self.recipes[:3])
+        missing = Recipe.objects.latest('id').pk + 1
+        url = '/api/recipes/bulk/favorite/'
+        response = self.client.post(
+            url, {'ids': [first, second, first, missing]}, format='json')
+        self.assertEqual(self.statuses(response), [
+            (first, 'added'), (second, 'added'), (missing, 'not_found')])
+        response = self.client.post(
+            url, {'ids': [second, third]}, format='json')
+        self.assertEqual(self.statuses(response), [
+            (second, 'exists'), (third, 'added')])
+        self.assertEqual(self.counters('favorites_count'), [1, 1, 1])
+        response = self.client.delete(f'{url}?ids={first},{third},{missing}')
+        self.assertEqual(self.statuses(response), [
+            (first, 'removed'), (third, 'removed'), (missing, 'not_found')])
+        response = self.client.delete(f'{url}?ids={first}')
+        self.assertEqual(self.statuses(response), [(first, 'absent')])
+        self.assertEqual(self.counters('favorites_count'), [0, 1, 0])
+        self.assertEqual(self.client.post(
+            url, {'ids': []}, format='json').status_code, 400)
+        self.assertEqual(self.guest.post(
+            url, {'ids': [first]}, format='json').status_code, 401)
+
+    def test_shopping_cart(self):
+        ids = [recipe.pk for recipe in self.recipes[:3]]
+        url = '/api/recipes/bulk/shopping_cart/'
+        response = self.client.post(url, {'ids': ids}, format='json')
+        self.assertEqual(self.statuses(response),
+                         [(pk, 'added') for pk in ids])
+        self.assertEqual(stored_shopping_lists(), build_shopping_lists())
+        self.assertEqual(
+            stored_shopping_lists()[self.user.pk][self.ingredients[2].pk],
+            30)
+        response = self.client.delete(url, {'ids': ids[:2]}, format='json')
+        self.assertEqual(self.statuses(response),
+                         [(pk, 'removed') for pk in ids[:2]])
+        self.assertEqual(stored_shopping_lists(), build_shopping_lists())
+        self.assertEqual(self.counters('in_carts_count'), [0, 0, 1])
+
+    def test_create(self):
+        recipe = {
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 5}],
+            'tags': [self.tags[0].pk], 'image': PNG,
+            'name': 'Новый рецепт', 'text': 'Описание', 'cooking_time': 5,
+        }
+        response = self.client.post('/api/recipes/bulk/', [
+            recipe, {**recipe, 'ingredients': [{'id': 0, 'amount': 1}]},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        created, invalid = response.json()
+        self.assertEqual(created['status'], 'created')
+        self.assertTrue(Recipe.objects.filter(
+            pk=created['id'], author=self.user).exists())
+        self.assertEqual(invalid['status'], 'invalid')
+        self.assertIn('ingredients', invalid['errors'])
+        response = self.client.post('/api/recipes/bulk/', recipe,
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ToggleTest(APITestCase):
+    """Добавление в избранное, корзину и подписка - один INSERT
+    ... ON CONFLICT DO NOTHING без предварительной проверки,
+    удаление - один DELETE; повтор не создает второй строки
+    и не меняет счетчики."""
+
+    def statements(self, method, url, table):
+        with CaptureQueriesContext(connection) as queries:
+            response = method(url)
+        statements = [query['sql'].split()[0] for query in queries
+                      if f'"{table}"' in query['sql']]
+        return response.status_code, statements
+
+    def assert_toggle(self, action, table, counter):
+        recipe = self.recipes[1]
+        url = f'/api/recipes/{recipe.pk}/{action}/'
+        self.assertEqual(self.statements(self.client.post, url, table),
+                         (200, ['INSERT']))
+        self.assertEqual(self.client.post(url).status_code, 400)
+        recipe.refresh_from_db()
+        self.assertEqual(getattr(recipe, counter), 1)
+        self.assertEqual(self.statements(self.client.delete, url, table),
+                         (200, ['DELETE']))
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        recipe.refresh_from_db()
+        self.assertEqual(getattr(recipe, counter), 0)
+        missing = Recipe.objects.latest('id').pk + 1
+        self.assertEqual(self.client.post(
+            f'/api/recipes/{missing}/{action}/').status_code, 404)
+        self.assertEqual(self.guest.post(url).status_code, 401)
+
+    def test_favorite(self):
+        self.assert_toggle('favorite', 'recipes_favorites', 'favorites_count')
+        self.assertFalse(Favorites.objects.exists())
+
+    def test_shopping_cart(self):
+        self.assert_toggle(
+            'shopping_cart', 'recipes_shoppingcart', 'in_carts_count')
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        status, statements = self.statements(
+            self.client.post, url, 'users_subscription')
+        self.assertEqual(status, 200)
+        self.assertEqual(statements[0], 'INSERT')
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.client.post(
+            f'/api/users/{self.user.pk}/subscribe/').status_code, 400)
+        self.assertTrue(self.client.get(
+            f'/api/users/{self.author.pk}/').json()['is_subscribed'])
+        # post_delete подписки чистит ленту, поэтому Django читает
+        # удаляемые строки перед DELETE.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.statements(
+                self.client.delete, url, 'users_subscription'),
+                (200, ['SELECT', 'DELETE']))
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.assertFalse(self.client.get(
+            f'/api/users/{self.author.pk}/').json()['is_subscribed'])
+
+
+class AsyncViewsTest(APITestCase):
+    """Асинхронные справочники (ASYNC_READ_VIEWS) отдают те же
+    данные, что и вьюсеты DRF, остальные методы передаются
+    синхронным вьюсетам. Маршруты подключаются при импорте
+    api.urls, поэтому представления вызываются напрямую."""
+
+    def call(self, view_class, actions, method, path, data=None, **kwargs):
+        view = view_class.as_view(actions=actions)
+        factory = AsyncRequestFactory()
+        if method == 'get':
+            request = factory.get(path, data)
+        else:
+            request = getattr(factory, method)(
+                path, data, content_type='application/json')
+        response = async_to_sync(view)(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response.status_code, json.loads(response.content)
+
+    def test_tags(self):
+        tag = self.tags[0]
+        actions = {'get': 'list', 'post': 'create'}
+        self.assertEqual(self.call(TagAsyncView, actions, 'get', '/'),
+                         (200, self.guest.get('/api/tags/').json()))
+        actions = {'get': 'retrieve'}
+        self.assertEqual(
+            self.call(TagAsyncView, actions, 'get', '/', pk=tag.pk),
+            (200, self.guest.get(f'/api/tags/{tag.pk}/').json()))
+        for pk in (Tag.objects.latest('id').pk + 1, 'slug'):
+            status, _ = self.call(TagAsyncView, actions, 'get', '/', pk=pk)
+            self.assertEqual(status, 404)
+
+    def test_delegates_writes(self):
+        status, data = self.call(
+            TagAsyncView, {'get': 'list', 'post': 'create'}, 'post', '/',
+            {'name': 'Новый', 'color': '#FFFFFF', 'slug': 'new'})
+        self.assertEqual(status, 201)
+        self.assertTrue(Tag.objects.filter(pk=data['id']).exists())
+
+    def test_ingredients(self):
+        ingredient_index.invalidate()
+        actions = {'get': 'list'}
+        for params in ({}, {'name': 'ИНГРЕДИЕНТ 1'},
+                       {'measurement_unit': 'г'}):
+            self.assertEqual(
+                self.call(IngredientAsyncView, actions, 'get', '/', params),
+                (200, self.guest.get('/api/ingredients/', params).json()))
+
+
+class ResponseCacheTest(APITestCase):
+    """Вытеснение счетчика поколения не возвращает устаревшие ответы."""
+
+    def test_evicted_generation(self):
+        recipe = self.recipes[-1]
+        url = f'/api/recipes/{recipe.pk}/'
+        self.assertEqual(self.guest.get(url).json()['name'], recipe.name)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            name='Новое название', updated_at=timezone.now())
+        self.assertEqual(self.guest.get(url).json()['name'], recipe.name)
+        cache.delete(GENERATION_KEY.format('recipes'))
+        self.assertEqual(self.guest.get(url).json()['name'],
+                         'Новое название')
+
+    def test_generation_bumped_after_commit(self):
+        before = get_generations(('recipes',))
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_generation('recipes')
+            self.assertEqual(get_generations(('recipes',)), before)
+        self.assertNotEqual(get_generations(('recipes',)), before)
+
+    def test_popular_list_follows_favorites(self):
+        url = '/api/recipes/?ordering=popular&limit=1'
+        recipe = self.recipes[5]
+        self.assertNotEqual(self.guest.get(url).json()['results'][0]['id'],
+                            recipe.pk)
+        recipes_generation = get_generations(('recipes',))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertEqual(self.guest.get(url).json()['results'][0]['id'],
+                         recipe.pk)
+        self.assertEqual(get_generations(('recipes',)), recipes_generation)
+
+
+class UserIdsCacheTest(APITestCase):
+    """Массив id, прочитанный из базы до записи и сохраненный
+    после нее, не читается: запись меняет версию ключа."""
+
+    def test_late_fill_is_ignored(self):
+        recipe = self.recipes[0]
+        version = get_counter(
+            USER_IDS_VERSION_KEY.format(self.user.pk, 'favorites'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{recipe.pk}/favorite/')
+        cache.set(USER_IDS_KEY.format(self.user.pk, 'favorites', version),
+                  array('q'))
+        self.assertEqual(list(get_user_ids(self.user, 'favorites')),
+                         [recipe.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertEqual(list(get_user_ids(self.user, 'favorites')), [])
+
+
+class TokenCacheTest(APITestCase):
+    """Кеш токенов хранит только поля авторизации,
+    профиль пользователя читается из базы."""
+
+    def test_cached_user(self):
+        self.client.get('/api/users/me/')
+        self.assertEqual(local_tokens.get(self.token.key), {
+            'id': self.user.pk, 'is_active': True,
+            'is_staff': False, 'is_superuser': False})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.json()['email'], self.user.email)
+        user_queries = [
+            query['sql'] for query in queries.captured_queries
+            if 'authtoken' in query['sql']
+            or 'users_customuser' in query['sql']]
+        self.assertEqual(len(user_queries), 1)
+        self.assertNotIn('authtoken', user_queries[0])
+
+
+class RecommendationSeedsTest(APITestCase):
+    """Рекомендации строятся по рецептам, добавленным последними,
+    а не по рецептам с наибольшими id."""
+
+    def test_seeds_are_latest_added(self):
+        older, newer = self.recipes[5], self.recipes[3]
+        now = timezone.now()
+        Favorites.objects.create(user=self.user, recipe=older)
+        ShoppingCart.objects.create(user=self.user, recipe=newer)
+        Favorites.objects.filter(recipe=older).update(
+            created_at=now - timedelta(days=1))
+        ShoppingCart.objects.filter(recipe=newer).update(created_at=now)
+        RecipeNeighbor.objects.bulk_create([
+            RecipeNeighbor(recipe=older, neighbor=self.recipes[9], score=1),
+            RecipeNeighbor(recipe=newer, neighbor=self.recipes[7], score=1),
+        ])
+        with mock.patch('api.views.RECOMMENDATION_SEEDS', 1):
+            response = self.client.get('/api/recipes/recommended/')
+        self.assertEqual([recipe['id'] for recipe in response.json()],
+                         [self.recipes[7].pk])
+
+    def test_build_neighbors(self):
+        first, second = self.recipes[0], self.recipes[2]
+        for user in (self.user, self.author):
+            Favorites.objects.create(user=user, recipe=first)
+            ShoppingCart.objects.create(user=user, recipe=second)
+        call_command('build_recommendations', stdout=StringIO())
+        # Общие пользователи дают косинус 1, общие теги - 1 с весом 0.2,
+        # ингредиенты есть в большинстве рецептов и не учитываются.
+        neighbors = sorted(RecipeNeighbor.objects.values_list(
+            'recipe', 'neighbor', 'score'))
+        self.assertEqual([pair[:2] for pair in neighbors],
+                         [(first.pk, second.pk), (second.pk, first.pk)])
+        for *_, score in neighbors:
+            self.assertAlmostEqual(score, 1.2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_PIPELINE_EAGER=True)
+class RecipeImageFilesTest(APITestCase):
+    """Файл изображения, общий для нескольких рецептов,
+    удаляется вместе с последней ссылкой на него."""
+
+    def create(self, name, image=PNG):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {
+                'ingredients': [{'id': self.ingredients[0].pk,
+                                 'amount': 10}],
+                'tags': [self.tags[0].pk], 'image': image, 'name': name,
+                'text': 'Описание', 'cooking_time': 5}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Recipe.objects.get(pk=response.json()['id'])
+
+    def delete(self, recipe):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{recipe.pk}/')
+
+    def test_shared_files(self):
+        first, second = self.create('Первый'), self.create('Второй')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_renditions, second.image_renditions)
+        names = recipe_files(first.image, first.image_renditions)
+        storage = first.image.storage
+        self.assertEqual(
+            dict(StoredFile.objects.filter(name__in=names).values_list(
+                'name', 'references')),
+            dict.fromkeys(names, 2))
+        self.delete(first)
+        self.assertTrue(all(map(storage.exists, names)))
+        self.delete(second)
+        self.assertFalse(any(map(storage.exists, names)))
+        self.assertFalse(StoredFile.objects.filter(name__in=names).exists())
+        third = self.create('Третий')
+        self.assertEqual(third.image.name, first.image.name)
+        self.assertTrue(storage.exists(third.image.name))
+
+    def test_base64_with_line_breaks(self):
+        header, data = PNG.split(',')
+        wrapped = '\n'.join(data[i:i + 20] for i in range(0, len(data), 20))
+        recipe = self.create('С переносами', f'{header},{wrapped}\r\n')
+        self.assertEqual(recipe.image.name, self.create('Без').image.name)
+
+    @override_settings(IMAGE_PIPELINE_EAGER=False)
+    def test_rebuild_lost_renditions(self):
+        with mock.patch('recipes.images.get_executor'):
+            recipe = self.create('Потерянный')
+        self.assertEqual(recipe.image_renditions, {})
+        call_command('build_renditions', stdout=StringIO(),
+                     stderr=StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_renditions['source'],
+                         recipe.image.name)
+        names = recipe_files(recipe.image, recipe.image_renditions)
+        self.assertEqual(
+            set(StoredFile.objects.filter(name__in=names).values_list(
+                'references', flat=True)), {1})
@@ -1,5 +1,6 @@
-from api.views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
-                       TagViewSet)
+from api.views import (CustomUserViewSet, IngredientViewSet, MetricsView,
+                       RecipeViewSet, TagViewSet)
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
@@ -10,7 +11,25 @@ router.register(r'ingredients', IngredientViewSet, basename='ingredients')
 router.register(r'tags', TagViewSet, basename='tags')
 
 
-urlpatterns = [
+urlpatterns = []
+
+if settings.ASYNC_READ_VIEWS:
+    from api.async_views import IngredientAsyncView, TagAsyncView
+
+    urlpatterns += [
+        path('tags/', TagAsyncView.as_view(
+            actions={'get': 'list', 'post': 'create'})),
+        path('tags/<pk>/', TagAsyncView.as_view(
+            actions={'get': 'retrieve', 'put': 'update',
+                     'patch': 'partial_update', 'delete': 'destroy'})),
+        path('ingredients/', IngredientAsyncView.as_view(
+            actions={'get': 'list'})),
+        path('ingredients/<pk>/', IngredientAsyncView.as_view(
+            actions={'get': 'retrieve'})),
+    ]
+
+urlpatterns += [
     path('', include(router.urls)),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path(r'auth/', include('djoser.urls.authtoken')),
 ]
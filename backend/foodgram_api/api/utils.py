@@ -1,16 +1,99 @@
-from recipes.models import IngredientInRecipe
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
 
+from api.cache import bump_generation
+from api.matching import recipe_match_index
+from recipes.models import IngredientInRecipe, Recipe
+from recipes.search import update_search_vectors
+from recipes.utils import update_recipe_in_shopping_lists
 
-def create_update_ing(ingredients, recipe):
+
+def diff_ingredients(rows, amounts):
+    """Сравнивает строки IngredientInRecipe рецепта с новым составом
+    {id ингредиента: количество}. Возвращает ингредиенты для
+    добавления, строки с измененным количеством и id строк
+    для удаления (включая повторы одного ингредиента)."""
+    existing = {}
+    to_delete = []
+    for row in rows:
+        if row.ingredient_id in existing or row.ingredient_id not in amounts:
+            to_delete.append(row.pk)
+        else:
+            existing[row.ingredient_id] = row
+    to_update = []
+    for ingredient_id, row in existing.items():
+        if row.amount != amounts[ingredient_id]:
+            row.amount = amounts[ingredient_id]
+            to_update.append(row)
+    to_create = amounts.keys() - existing.keys()
+    return to_create, to_update, to_delete
+
+
+@transaction.atomic
+def create_update_ing(amounts, recipe):
     """Вспомогательная функция для добавления ингредиентов.
-    Используется при создании/редактировании рецепта."""
-    ing_lst = []
-    for ingredient in ingredients:
-        ing_lst.append(
-            IngredientInRecipe(
-                name=recipe,
-                ingredient=ingredient['ingredient'].get('id'),
-                amount=ingredient.get('amount')
-            )
-        )
-    IngredientInRecipe.objects.bulk_create(ing_lst)
+    Используется при создании/редактировании рецепта.
+    amounts - словарь {id ингредиента: количество}. Меняются только
+    отличающиеся строки: новые добавляются одним INSERT, измененные
+    обновляются одним bulk_update, лишние удаляются одним DELETE.
+    Если состав изменился, пересчитывает списки покупок, в которых
+    уже есть рецепт, поисковый вектор и индекс подбора рецептов.
+    Дата изменения рецепта для кеша фрагментов обновляется всегда."""
+    rows = list(IngredientInRecipe.objects.select_for_update().filter(
+        name=recipe))
+    old_amounts = {}
+    for row in rows:
+        old_amounts[row.ingredient_id] = (
+            old_amounts.get(row.ingredient_id, 0) + row.amount)
+    to_create, to_update, to_delete = diff_ingredients(rows, amounts)
+    if to_delete:
+        IngredientInRecipe.objects.filter(pk__in=to_delete).delete()
+    if to_update:
+        IngredientInRecipe.objects.bulk_update(to_update, ('amount',))
+    IngredientInRecipe.objects.bulk_create(
+        IngredientInRecipe(name=recipe, ingredient_id=ingredient_id,
+                           amount=amounts[ingredient_id])
+        for ingredient_id in to_create)
+    recipe.updated_at = timezone.now()
+    Recipe.objects.filter(pk=recipe.pk).update(updated_at=recipe.updated_at)
+    bump_generation('recipes')
+    if old_amounts == amounts:
+        return
+    update_search_vectors([recipe.pk])
+    ingredient_ids = list(amounts)
+    transaction.on_commit(lambda: recipe_match_index.update_recipe(
+        recipe.pk, ingredient_ids))
+    update_recipe_in_shopping_lists(recipe, old_amounts, amounts)
+
+
+def insert_ignore(model, **values):
+    """Добавляет строку model одним запросом
+    INSERT ... ON CONFLICT DO NOTHING RETURNING.
+    Возвращает созданный объект или None, если такая строка уже есть,
+    так что проверка уникальности и вставка не разделены гонкой.
+    Для созданного объекта отправляется post_save, как при save()."""
+    instance = model(**values)
+    meta = model._meta
+    fields = [field for field in meta.concrete_fields
+              if not field.primary_key]
+    quote = connection.ops.quote_name
+    params = [field.get_db_prep_save(field.pre_save(instance, True),
+                                     connection)
+              for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(meta.db_table)} '
+            f'({", ".join(quote(field.column) for field in fields)}) '
+            f'VALUES ({", ".join(["%s"] * len(fields))}) '
+            f'ON CONFLICT DO NOTHING RETURNING {quote(meta.pk.column)}',
+            params)
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    instance.pk = row[0]
+    instance._state.adding = False
+    instance._state.db = connection.alias
+    post_save.send(sender=model, instance=instance, created=True,
+                   update_fields=None, raw=False, using=connection.alias)
+    return instance
@@ -1,60 +1,130 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Count, F, Prefetch
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.permissions import (AllowAny, IsAuthenticated)
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import (AllowAny, IsAdminUser,
+                                        IsAuthenticated)
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
+from api import metrics
+from api.bulk import (BULK_MAX_RECIPES, bulk_add, bulk_create_recipes,
+                      bulk_remove, lock_user)
+from api.cache import AnonymousCacheMixin
 from api.filters import IngredientFilter, RecipeFilters, RecipeAnonymousFilters
+from api.loaders import get_user_ids, invalidate_user_ids
+from api.matching import MATCH_LIMIT, recipe_match_index
+from api.pagination import FeedPagination
 from api.permissions import IsAuthorAdminOrReadOnly
-from api.serializers import (IngredientSerializer,
+from api.renderers import SHOPPING_LIST_RENDERERS
+from api.search import ingredient_index
+from api.serializers import (BulkIdsSerializer, IngredientSerializer,
                              RecipeCreateUpdateSerializer,
                              RecipeMinifiedSerializer, RecipeSerializer,
                              ShoppingCartSerializer, SubscriptionSerializer,
                              TagSerializer)
+from api.utils import insert_ignore
+from recipes import timelines
 from recipes.models import (Favorites, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.recommendations import recent_recipe_ids, recommend
+from recipes.utils import (POPULAR_ORDERING, add_to_shopping_list,
+                           change_counter, remove_from_shopping_list)
 from users.models import CustomUser, Subscription
 
+SHOPPING_LIST_CHUNK_SIZE = 2000
+RECOMMENDATION_SEEDS = 50
+
+
+def already_exists(message):
+    """Ошибка повторного добавления в формате ошибок сериализатора."""
+    return ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
+
 
 class CustomUserViewSet(UserViewSet):
     """Вьюсет модели пользователя, наследуется от djoser.views.UserViewSet."""
     # queryset = CustomUser.objects.all()
+    pagination_class = FeedPagination
+    cursor_ordering = ('id',)
+
+    def get_instance(self):
+        """Пользователь из кеша токенов содержит только поля
+        авторизации, профиль для /users/me/ читается одним запросом."""
+        user = self.request.user
+        deferred = user.get_deferred_fields()
+        if deferred:
+            user.refresh_from_db(fields=deferred)
+        return user
+
+    def get_recipes_limit(self):
+        """Возвращает значение параметра recipes_limit или None."""
+        try:
+            limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return limit if limit > 0 else None
 
     @action(detail=False, permission_classes=(IsAuthenticated, ))
     def subscriptions(self, request):
-        """Метод возвращает список подписок пользователя."""
-        queryset = CustomUser.objects.filter(following__user=request.user)
+        """Метод возвращает список подписок пользователя.
+        Рецепты авторов подгружаются одним запросом с ограничением
+        recipes_limit на каждого автора, количество - аннотацией."""
+        recipes_limit = self.get_recipes_limit()
+        recipes = Recipe.objects.only(
+            'id', 'author', 'name', 'image', 'image_renditions',
+            'cooking_time'
+        ).order_by('-pub_date', '-id')
+        if recipes_limit:
+            recipes = recipes[:recipes_limit]
+        queryset = CustomUser.objects.filter(
+            following__user=request.user
+        ).annotate(
+            recipes_count=Count('recipes'),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='recipes_preview')
+        ).order_by('id')
         subs = self.paginate_queryset(queryset)
         serializer = SubscriptionSerializer(
-            subs, many=True, context={'request': request})
+            subs, many=True, context={'request': request,
+                                      'recipes_limit': recipes_limit})
         return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=(IsAuthenticated, ))
     def subscribe(self, request, **kwargs):
-        """Метод подписки/отписки на пользователя."""
-        subscription = get_object_or_404(CustomUser, id=kwargs['id'])
+        """Метод подписки/отписки на пользователя.
+        Подписка добавляется одним INSERT ... ON CONFLICT DO NOTHING,
+        отписка - удалением по паре пользователей без чтения подписки."""
         if request.method == 'POST':
+            subscription = get_object_or_404(CustomUser, id=kwargs['id'])
             serializer = SubscriptionSerializer(
                 subscription, data=request.data,
                 context={
                     'request': request,
-                    'subscription': subscription
+                    'subscription': subscription,
+                    'recipes_limit': self.get_recipes_limit(),
                 })
             serializer.is_valid(raise_exception=True)
-            Subscription.objects.create(
-                user=request.user, subscription=subscription)
+            if not insert_ignore(Subscription, user=request.user,
+                                 subscription=subscription):
+                raise already_exists(
+                    'Вы уже подписаны на данного пользователя.')
+            invalidate_user_ids(request.user, 'subscriptions')
             return Response(serializer.data)
         if request.method == 'DELETE':
-            subscription = get_object_or_404(
-                Subscription, user=request.user,
-                subscription=subscription)
-            subscription.delete()
+            deleted, _ = Subscription.objects.filter(
+                user=request.user, subscription=kwargs['id']).delete()
+            if not deleted:
+                raise Http404
+            invalidate_user_ids(request.user, 'subscriptions')
             return Response('Вы отписались от автора')
 
 
@@ -66,6 +136,14 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        """Поиск по названию обслуживается индексом в памяти."""
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        return Response(ingredient_index.search(
+            name, request.query_params.get('measurement_unit')))
+
 
 class TagViewSet(viewsets.ModelViewSet):
     """Вьюсет модели тега."""
@@ -75,76 +153,245 @@ class TagViewSet(viewsets.ModelViewSet):
     pagination_class = None
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AnonymousCacheMixin, viewsets.ModelViewSet):
     """Вьюсет модели рецепта."""
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthorAdminOrReadOnly, )
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilters
+    pagination_class = FeedPagination
+    cache_scopes = ('recipes', 'tags', 'users', 'ingredients')
+
+    def get_cache_scopes(self, request):
+        """Списки по популярности зависят и от счетчиков, которые
+        меняются без сигналов моделей (recipes.utils.popularity_changed).
+        Остальные ответы при добавлении в избранное не сбрасываются."""
+        if request.query_params.get('ordering') in ('popular', 'trending'):
+            return self.cache_scopes + ('popularity',)
+        return self.cache_scopes
 
     def get_queryset(self):
         if self.request.user.is_anonymous:
             self.filterset_class = RecipeAnonymousFilters
-        return super().get_queryset()
+        return super().get_queryset().select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch('recipes', queryset=IngredientInRecipe.objects
+                     .select_related('ingredient')),
+        )
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return RecipeSerializer
         return RecipeCreateUpdateSerializer
 
+    def get_int_params(self, name):
+        """Возвращает список целых из параметра вида ?name=1,2&name=3."""
+        try:
+            return [int(value)
+                    for values in self.request.query_params.getlist(name)
+                    for value in values.split(',') if value]
+        except ValueError:
+            raise ValidationError({name: 'Ожидаются целые числа.'})
+
+    def get_limit(self):
+        """Размер ответа для выборок без пагинации."""
+        limit = (self.get_int_params('limit') or [MATCH_LIMIT])[0]
+        return min(max(limit, 1), FeedPagination.max_page_size)
+
+    @action(detail=False)
+    def match(self, request):
+        """Подбор рецептов по ингредиентам в наличии:
+        ?ingredients=1,2,3, необязательные limit и max_missing.
+        Рецепты отсортированы по доле имеющихся ингредиентов
+        (coverage) и числу недостающих (missing)."""
+        ingredient_ids = self.get_int_params('ingredients')
+        if not ingredient_ids:
+            raise ValidationError({'ingredients': 'Укажите ингредиенты.'})
+        limit = self.get_limit()
+        max_missing = (self.get_int_params('max_missing') or [None])[0]
+        matches = recipe_match_index.match(ingredient_ids, limit, max_missing)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in matches])
+        matches = [match for match in matches if match[0] in recipes]
+        data = RecipeSerializer(
+            [recipes[recipe_id] for recipe_id, _, _ in matches],
+            many=True, context=self.get_serializer_context()).data
+        for item, (_, coverage, missing) in zip(data, matches):
+            item['coverage'] = round(coverage, 4)
+            item['missing'] = missing
+        return Response(data)
+
     @action(detail=False, permission_classes=(IsAuthenticated, ))
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь.
+        Поддерживает ту же пагинацию, что и список рецептов:
+        страница выбирается из записей ленты по индексу,
+        затем одним запросом загружаются ее рецепты."""
+        self.cursor_ordering = timelines.FEED_ORDERING
+        page = self.paginate_queryset(timelines.feed(
+            request.user, get_user_ids(request.user, 'subscriptions')))
+        recipes = self.get_queryset().in_bulk(
+            [entry.recipe_id for entry in page])
+        serializer = RecipeSerializer(
+            [recipes[entry.recipe_id] for entry in page
+             if entry.recipe_id in recipes],
+            many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, permission_classes=(IsAuthenticated, ))
+    def recommended(self, request):
+        """Рекомендации по последним рецептам пользователя
+        в избранном и корзине и таблице похожих рецептов.
+        Без истории или рекомендаций отдаются популярные рецепты."""
+        limit = self.get_limit()
+        seen = set(get_user_ids(request.user, 'favorites'))
+        seen.update(get_user_ids(request.user, 'shopping_cart'))
+        seeds = recent_recipe_ids(request.user, RECOMMENDATION_SEEDS)
+        ranked = recommend(seeds, exclude_ids=seen)[:2 * limit]
+        queryset = self.get_queryset().exclude(author=request.user)
+        recipes = queryset.in_bulk(ranked)
+        result = [recipes[pk] for pk in ranked if pk in recipes][:limit]
+        if not result:
+            result = queryset.exclude(id__in=seen).order_by(
+                *POPULAR_ORDERING)[:limit]
+        return Response(RecipeSerializer(
+            result, many=True, context=self.get_serializer_context()).data)
+
+    @action(detail=False, methods=['post'], url_path='bulk',
+            permission_classes=(IsAuthenticated, ))
+    def bulk_create(self, request):
+        """Создание до BULK_MAX_RECIPES рецептов одним запросом.
+        Тело - список рецептов в формате POST /api/recipes/,
+        ответ - список {status, id} или {status, errors}."""
+        if not isinstance(request.data, list):
+            raise ValidationError('Ожидается список рецептов.')
+        if len(request.data) > BULK_MAX_RECIPES:
+            raise ValidationError(
+                f'Не больше {BULK_MAX_RECIPES} рецептов за запрос.')
+        return Response(bulk_create_recipes(
+            RecipeCreateUpdateSerializer, request.data,
+            self.get_serializer_context()))
+
+    def bulk_relation(self, request, kind):
+        """Массовое добавление (POST) или удаление (DELETE) рецептов
+        в избранном или корзине. id передаются в теле {"ids": [...]}
+        или, для DELETE, параметром ?ids=1,2,3."""
+        data = request.data or {'ids': self.get_int_params('ids')}
+        serializer = BulkIdsSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        handler = bulk_add if request.method == 'POST' else bulk_remove
+        return Response(handler(
+            request.user, kind, serializer.validated_data['ids']))
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='bulk/favorite', permission_classes=(IsAuthenticated, ))
+    def bulk_favorite(self, request):
+        return self.bulk_relation(request, 'favorites')
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='bulk/shopping_cart',
+            permission_classes=(IsAuthenticated, ))
+    def bulk_shopping_cart(self, request):
+        return self.bulk_relation(request, 'shopping_cart')
+
+    @action(detail=False, permission_classes=(IsAuthenticated, ),
+            renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_cart(self, request):
-        """Метод возвращает список покупок."""
-        ing_in_rep = IngredientInRecipe.objects.filter(
-            name__recipe_in_cart__user=request.user).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(ing_amount=Sum('amount'))
-        shopping_lst = ['Список покупок:\n']
-        for ing in ing_in_rep:
-            name = ing['ingredient__name'].capitalize()
-            unit = ing['ingredient__measurement_unit']
-            amount = ing['ing_amount']
-            shopping_lst.append(f'\n{name} ({unit}) — {amount}')
-        response = HttpResponse(shopping_lst,
-                                content_type='text/plain; charset=utf-8')
-        filename = f'{request.user.username}_shopping_list.txt'
+        """Метод возвращает список покупок.
+        Формат выбирается параметром ?format= или заголовком Accept,
+        строки сводного списка читаются курсором и отдаются потоком.
+        Под ASGI поток асинхронный (aiterator), иначе Django
+        прочитал бы синхронный итератор целиком до отправки."""
+        renderer = request.accepted_renderer
+        rows = ShoppingListItem.objects.filter(user=request.user).values(
+            'amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        ).order_by('name')
+        if isinstance(request._request, ASGIRequest):
+            content = renderer.astream(
+                rows.aiterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE))
+        else:
+            content = renderer.stream(
+                rows.iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE))
+        response = StreamingHttpResponse(
+            content,
+            content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        filename = f'{request.user.username}_shopping_list.{renderer.format}'
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=(IsAuthorAdminOrReadOnly, ))
     def shopping_cart(self, request, **kwargs):
+        """Добавление рецепта в корзину одним INSERT ... ON CONFLICT
+        DO NOTHING и удаление одним DELETE. Счетчик и сводный список
+        покупок меняются, только если строка действительно
+        добавлена или удалена, поэтому повторный запрос их не портит.
+        Пользователь блокируется, как в массовых операциях api/bulk.py,
+        иначе массовое добавление учло бы ту же строку второй раз."""
         if request.user.is_anonymous:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        products = get_object_or_404(Recipe, id=kwargs['pk'])
         if request.method == 'POST':
-            serializer = ShoppingCartSerializer(products, data=request.data,
-                                                context={'request': request,
-                                                         'products': products,
-                                                         })
-            serializer.is_valid(raise_exception=True)
-            ShoppingCart.objects.create(user=request.user, recipe=products)
-            return Response(serializer.data)
+            products = get_object_or_404(Recipe, id=kwargs['pk'])
+            with transaction.atomic():
+                lock_user(request.user)
+                if not insert_ignore(ShoppingCart, user=request.user,
+                                     recipe=products):
+                    raise already_exists(
+                        'Этот рецепт уже есть в списке покупок.')
+                change_counter(products.pk, 'in_carts_count', 1)
+                add_to_shopping_list(request.user, products)
+            invalidate_user_ids(request.user, 'shopping_cart')
+            return Response(ShoppingCartSerializer(
+                products, context={'request': request}).data)
         if request.method == 'DELETE':
-            favorites = get_object_or_404(
-                ShoppingCart, user=request.user, recipe=products)
-            favorites.delete()
+            recipe_id = int(kwargs['pk'])
+            with transaction.atomic():
+                lock_user(request.user)
+                deleted, _ = ShoppingCart.objects.filter(
+                    user=request.user, recipe=recipe_id).delete()
+                if not deleted:
+                    raise Http404
+                change_counter(recipe_id, 'in_carts_count', -1)
+                remove_from_shopping_list(request.user, recipe_id)
+            invalidate_user_ids(request.user, 'shopping_cart')
             return Response('Вы удалили рецепт из списка покупок')
 
-    @action(detail=True, methods=['post', 'delete'])
+    @action(detail=True, methods=['post', 'delete'],
+            permission_classes=(IsAuthenticated, ))
     def favorite(self, request, **kwargs):
-        favorites = get_object_or_404(Recipe, id=kwargs['pk'])
+        """Добавление в избранное и удаление из него,
+        так же как shopping_cart."""
         if request.method == 'POST':
-            serializer = RecipeMinifiedSerializer(
-                favorites, data=request.data,
-                context={'request': request,
-                         'favorites': favorites
-                         })
-            serializer.is_valid(raise_exception=True)
-            Favorites.objects.create(user=request.user, recipe=favorites)
-            return Response(serializer.data)
+            favorites = get_object_or_404(Recipe, id=kwargs['pk'])
+            with transaction.atomic():
+                lock_user(request.user)
+                if not insert_ignore(Favorites, user=request.user,
+                                     recipe=favorites):
+                    raise already_exists('Этот рецепт уже есть в избранном.')
+                change_counter(favorites.pk, 'favorites_count', 1)
+            invalidate_user_ids(request.user, 'favorites')
+            return Response(RecipeMinifiedSerializer(
+                favorites, context={'request': request}).data)
         if request.method == 'DELETE':
-            favorites = get_object_or_404(
-                Favorites, user=request.user, recipe=favorites)
-            favorites.delete()
+            recipe_id = int(kwargs['pk'])
+            with transaction.atomic():
+                lock_user(request.user)
+                deleted, _ = Favorites.objects.filter(
+                    user=request.user, recipe=recipe_id).delete()
+                if not deleted:
+                    raise Http404
+                change_counter(recipe_id, 'favorites_count', -1)
+            invalidate_user_ids(request.user, 'favorites')
             return Response('Вы удалили рецепт из избранного')
+
+
+class MetricsView(APIView):
+    """Счетчики кешей для администраторов."""
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request):
+        return Response(metrics.report())
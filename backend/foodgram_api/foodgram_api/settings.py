@@ -91,6 +91,27 @@ DATABASES = {
 }
 
 
+# Cache
+# Для продакшена: CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# и CACHE_LOCATION=redis://<host>:6379/1
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+# Предел числа записей для бэкендов, которые его поддерживают:
+# по умолчанию Django хранит всего 300. Redis и memcached
+# ограничивают память сами (maxmemory, -m).
+if CACHES['default']['BACKEND'].split('.')[-2] in ('locmem', 'db',
+                                                   'filebased'):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 50000)),
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -131,6 +152,28 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Фоновая обработка изображений рецептов (recipes/images.py).
+# IMAGE_PIPELINE_EAGER=True выполняет ее сразу, без пула потоков.
+IMAGE_PIPELINE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', '2'))
+IMAGE_PIPELINE_EAGER = os.getenv('IMAGE_PIPELINE_EAGER', 'False') == 'True'
+MAX_IMAGE_UPLOAD_SIZE = 10 * 1024 * 1024
+
+# Кеш токенов авторизации (api/authentication.py): процессный LRU
+# и общий кеш. С LocMemCache общий кеш не виден другим процессам
+# и не сбрасывается в них при выходе, поэтому он включен, только если
+# задан внешний бэкенд (Redis, Memcached).
+AUTH_TOKEN_LOCAL_SIZE = int(os.getenv('AUTH_TOKEN_LOCAL_SIZE', '10000'))
+AUTH_TOKEN_LOCAL_TIMEOUT = int(os.getenv('AUTH_TOKEN_LOCAL_TIMEOUT', '10'))
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', '300'))
+AUTH_TOKEN_SHARED_CACHE = 'locmem' not in CACHES['default']['BACKEND']
+
+# Асинхронное чтение тегов и ингредиентов (api/async_views.py).
+# Включается при запуске под ASGI (infra/docker-compose.asgi.yml),
+# под WSGI асинхронные представления только добавили бы накладные расходы.
+# Синхронные представления под ASGI выполняются в одном потоке
+# на процесс (thread_sensitive), их параллельность - число воркеров.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -141,7 +184,7 @@ AUTH_USER_MODEL = 'users.CustomUser'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
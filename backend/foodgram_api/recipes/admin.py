@@ -1,7 +1,40 @@
+from contextlib import contextmanager
+
 from django.contrib import admin
+from django.db import transaction
+from django.utils import timezone
+
+from api.loaders import invalidate_user_ids
+from api.matching import recipe_match_index
 
 from .models import (Favorites, Ingredient, IngredientInRecipe, Recipe,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag)
+from .search import update_search_vectors
+from .utils import (add_to_shopping_list, change_counter, recipe_amounts,
+                    remove_from_shopping_list,
+                    update_recipe_in_shopping_lists)
+
+
+@contextmanager
+def ingredients_follow(recipe_ids):
+    """Переносит изменения ингредиентов рецептов recipe_ids,
+    сделанные внутри блока, туда же, куда create_update_ing:
+    в сводные списки покупок, поисковый вектор, дату изменения
+    (от нее зависит кеш фрагментов) и индекс подбора рецептов."""
+    old_amounts = {pk: recipe_amounts(pk) for pk in recipe_ids}
+    yield
+    for pk, amounts in old_amounts.items():
+        update_recipe_in_shopping_lists(pk, amounts)
+    update_search_vectors(old_amounts)
+    Recipe.objects.filter(pk__in=old_amounts).update(
+        updated_at=timezone.now())
+    ingredient_ids = {pk: list(recipe_amounts(pk)) for pk in old_amounts}
+
+    def update_match_index():
+        for pk, ids in ingredient_ids.items():
+            recipe_match_index.update_recipe(pk, ids)
+
+    transaction.on_commit(update_match_index)
 
 
 class RecipeShipInline(admin.TabularInline):
@@ -9,15 +42,103 @@ class RecipeShipInline(admin.TabularInline):
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author', 'favorites')
+    list_display = ('id', 'name', 'author', 'favorites_count',
+                    'in_carts_count')
     list_filter = ('name', 'author', 'tags')
     search_fields = ('name', 'author', 'tags')
     empty_value_display = '-пусто-'
     inlines = [RecipeShipInline, ]
-    readonly_fields = ('favorites',)
+    readonly_fields = ('favorites_count', 'in_carts_count')
+    list_select_related = ('author',)
+
+    def save_related(self, request, form, formsets, change):
+        """Ингредиенты из инлайна входят в поисковый вектор
+        и в сводные списки покупок."""
+        with ingredients_follow([form.instance.pk]):
+            super().save_related(request, form, formsets, change)
+
+
+class IngredientInRecipeAdmin(admin.ModelAdmin):
+    """Правка ингредиента рецепта пересчитывает списки покупок
+    рецепта до и после изменения, его поисковый вектор, дату
+    изменения и индекс подбора."""
+    list_display = ('name', 'ingredient', 'amount')
+    list_select_related = ('name', 'ingredient')
+
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.name_id}
+        if change:
+            recipe_ids.add(IngredientInRecipe.objects.values_list(
+                'name', flat=True).get(pk=obj.pk))
+        with ingredients_follow(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(
+            request, IngredientInRecipe.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('name', flat=True))
+        with ingredients_follow(recipe_ids):
+            super().delete_queryset(request, queryset)
+
+
+class ShoppingCartAdmin(admin.ModelAdmin):
+    """Записи корзины из админки меняют сводный список покупок
+    и счетчик популярности так же, как действие shopping_cart."""
+    list_display = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            self.remove(ShoppingCart.objects.get(pk=obj.pk))
+        super().save_model(request, obj, form, change)
+        add_to_shopping_list(obj.user, obj.recipe)
+        change_counter(obj.recipe_id, 'in_carts_count', 1)
+        invalidate_user_ids(obj.user, 'shopping_cart')
+
+    def delete_model(self, request, obj):
+        self.remove(obj)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            self.remove(obj)
+        super().delete_queryset(request, queryset)
+
+    @staticmethod
+    def remove(obj):
+        remove_from_shopping_list(obj.user, obj.recipe_id)
+        change_counter(obj.recipe_id, 'in_carts_count', -1)
+        invalidate_user_ids(obj.user, 'shopping_cart')
+
+
+class FavoritesAdmin(admin.ModelAdmin):
+    """Записи избранного из админки меняют счетчик популярности
+    так же, как действие favorite."""
+    list_display = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            self.remove(Favorites.objects.get(pk=obj.pk))
+        super().save_model(request, obj, form, change)
+        change_counter(obj.recipe_id, 'favorites_count', 1)
+        invalidate_user_ids(obj.user, 'favorites')
+
+    def delete_model(self, request, obj):
+        self.remove(obj)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            self.remove(obj)
+        super().delete_queryset(request, queryset)
 
-    def favorites(self, obj):
-        return Favorites.objects.filter(recipe=obj).count()
+    @staticmethod
+    def remove(obj):
+        change_counter(obj.recipe_id, 'favorites_count', -1)
+        invalidate_user_ids(obj.user, 'favorites')
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -29,7 +150,8 @@ class IngredientAdmin(admin.ModelAdmin):
 
 admin.site.register(Tag)
 admin.site.register(Ingredient, IngredientAdmin)
-admin.site.register(IngredientInRecipe)
+admin.site.register(IngredientInRecipe, IngredientInRecipeAdmin)
 admin.site.register(Recipe, RecipeAdmin)
-admin.site.register(ShoppingCart)
-admin.site.register(Favorites)
+admin.site.register(ShoppingCart, ShoppingCartAdmin)
+admin.site.register(ShoppingListItem)
+admin.site.register(Favorites, FavoritesAdmin)
@@ -0,0 +1,172 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from PIL import Image, ImageOps, features
+from recipes.models import Recipe, StoredFile
+from recipes.storage import lock_files
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (600, 600),
+    'full': (1600, 1600),
+}
+RENDITIONS_DIR = 'recipes/renditions/'
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    """Пул фоновых обработчиков изображений процесса.
+    Локальная замена очереди задач: в продакшене вместо него
+    можно подставить любой исполнитель с методом submit()."""
+    return ThreadPoolExecutor(
+        max_workers=settings.IMAGE_PIPELINE_WORKERS,
+        thread_name_prefix='recipe-images')
+
+
+def rendition_format():
+    return ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def render(image, size):
+    """Уменьшает изображение до размера size с сохранением пропорций."""
+    rendition = image.copy()
+    rendition.thumbnail(size, Image.LANCZOS)
+    if rendition.mode in ('RGB', 'RGBA'):
+        return rendition
+    return rendition.convert('RGBA' if 'A' in rendition.mode else 'RGB')
+
+
+def recipe_files(image, renditions):
+    """Имена файлов, на которые ссылается рецепт."""
+    names = {name for key, name in renditions.items() if key != 'source'}
+    if image:
+        names.add(str(image))
+    return names
+
+
+def acquire_files(names):
+    """Добавляет ссылки рецепта на файлы names.
+    Вызывается в транзакции сохранения рецепта."""
+    if not names:
+        return
+    with transaction.atomic():
+        lock_files(names)
+        StoredFile.objects.filter(name__in=names).update(
+            references=F('references') + 1)
+
+
+def release_files(storage, names):
+    """Убирает ссылки рецепта на файлы names и удаляет файлы,
+    на которые больше не ссылается ни один рецепт. Одинаковые
+    изображения хранятся в одном файле
+    (recipes.storage.ContentAddressedStorage), поэтому файл удаляется
+    под блокировкой его строки: параллельная загрузка того же
+    содержимого либо успеет добавить ссылку, либо дождется удаления
+    и запишет файл заново. Файлы без строки не удаляются."""
+    if not names:
+        return
+    with transaction.atomic():
+        files = StoredFile.objects.select_for_update().filter(
+            name__in=names).order_by('name')
+        unused = [file.name for file in files if file.references <= 1]
+        StoredFile.objects.filter(name__in=names).exclude(
+            name__in=unused).update(references=F('references') - 1)
+        StoredFile.objects.filter(name__in=unused).delete()
+        for name in unused:
+            storage.delete(name)
+
+
+def make_renditions(recipe, source):
+    """Строит и сохраняет уменьшенные копии изображения recipe."""
+    image_format, extension = rendition_format()
+    stem = os.path.splitext(os.path.basename(source))[0]
+    renditions = {'source': source}
+    with recipe.image.open('rb') as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        for name, size in RENDITIONS.items():
+            buffer = BytesIO()
+            rendition = render(image, size)
+            if image_format == 'JPEG' and rendition.mode == 'RGBA':
+                rendition = rendition.convert('RGB')
+            rendition.save(buffer, image_format, quality=82)
+            renditions[name] = recipe.image.storage.save(
+                f'{RENDITIONS_DIR}{stem}_{name}.{extension}',
+                ContentFile(buffer.getvalue()))
+    return renditions
+
+
+def stored_renditions(storage, source):
+    """Варианты изображения source, запомненные в строке его файла,
+    если среди них есть все размеры RENDITIONS и все их файлы
+    есть в хранилище."""
+    stored = StoredFile.objects.filter(name=source).first()
+    renditions = stored.renditions if stored is not None else {}
+    if set(RENDITIONS) <= set(renditions) and all(
+            map(storage.exists, recipe_files(None, renditions))):
+        return renditions
+    return None
+
+
+def build_renditions(recipe_id, source):
+    """Строит варианты изображения рецепта и сохраняет их пути
+    в Recipe.image_renditions, если изображение не сменилось.
+    Варианты запоминаются в строке файла изображения, и то же
+    изображение другого рецепта использует их повторно.
+    Изображение обрабатывается вне транзакции, затем строки файлов
+    блокируются до сохранения рецепта: если за это время файлы
+    удалили, они строятся заново под блокировкой."""
+    try:
+        recipe = Recipe.objects.filter(pk=recipe_id, image=source).first()
+        if recipe is None:
+            return
+        storage = recipe.image.storage
+        stored = stored_renditions(storage, source)
+        renditions = stored or make_renditions(recipe, source)
+        with transaction.atomic():
+            lock_files([source, *recipe_files(None, renditions)])
+            if not all(map(storage.exists, recipe_files(None, renditions))):
+                renditions = make_renditions(recipe, source)
+            if renditions != stored:
+                StoredFile.objects.filter(name=source).update(
+                    renditions=renditions)
+            recipe = Recipe.objects.select_for_update().filter(
+                pk=recipe_id, image=source).first()
+            if recipe is not None:
+                recipe.image_renditions = renditions
+                recipe.save(update_fields=('image_renditions', 'updated_at'))
+    except Exception:
+        logger.exception('Failed to build renditions for recipe %s',
+                         recipe_id)
+
+
+def build_renditions_in_worker(recipe_id, source):
+    """Обертка для фонового потока: закрывает его соединение с БД."""
+    close_old_connections()
+    try:
+        build_renditions(recipe_id, source)
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(recipe):
+    """Ставит построение вариантов изображения в фоновую обработку
+    после фиксации транзакции."""
+    source = recipe.image.name
+
+    def submit():
+        if settings.IMAGE_PIPELINE_EAGER:
+            build_renditions(recipe.pk, source)
+        else:
+            get_executor().submit(
+                build_renditions_in_worker, recipe.pk, source)
+
+    transaction.on_commit(submit)
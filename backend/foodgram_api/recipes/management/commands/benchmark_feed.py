@@ -0,0 +1,63 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from recipes.models import Recipe
+from recipes.timelines import feed
+from users.models import CustomUser, Subscription
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время первой страницы ленты подписок: '
+            'запрос по подпискам против лент (fan-out on write) '
+            'для пользователей с наибольшим числом подписок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=10,
+            help='Количество пользователей для замера.')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Количество повторов для замера времени.')
+        parser.add_argument(
+            '--page-size', type=int, default=6,
+            help='Размер страницы ленты.')
+
+    def measure(self, load, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            load()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    @staticmethod
+    def load(page):
+        """Страница ленты: записи по индексу, затем их рецепты."""
+        ids = list(page.all())
+        recipes = Recipe.objects.in_bulk(ids)
+        return [recipes[pk] for pk in ids if pk in recipes]
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.annotate(
+            total=Count('follower')).order_by('-total')[:options['users']]
+        size = options['page_size']
+        for user in users:
+            subscription_ids = set(Subscription.objects.filter(
+                user=user).values_list('subscription', flat=True))
+            query = Recipe.objects.filter(
+                author__following__user=user).order_by(
+                '-pub_date', '-id')[:size]
+            page = feed(user, subscription_ids).values_list(
+                'recipe', flat=True)[:size]
+            if list(query.values_list('id', flat=True)) != list(page):
+                self.stdout.write(self.style.WARNING(
+                    f'{user}: лента расходится с запросом, '
+                    f'выполните rebuild_timelines'))
+            repeat = options['repeat']
+            self.stdout.write(
+                f'{user} ({user.total} подписок): '
+                f'query {self.measure(lambda: list(query.all()), repeat):.3f}'
+                f' ms, timeline '
+                f'{self.measure(lambda: self.load(page), repeat):.3f} ms')
@@ -0,0 +1,61 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.filters import IngredientFilter
+from api.search import IngredientIndex
+from api.serializers import IngredientSerializer
+from recipes.models import Ingredient
+
+DEFAULT_QUERIES = ('мол', 'са', 'к', 'ёж', 'перец')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время поиска ингредиентов по началу названия: '
+            'индекс в памяти (api/search.py) против запроса istartswith '
+            'через IngredientFilter на текущем справочнике '
+            '(загружается командой ingredients).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--query', action='append', dest='queries',
+            help='Поисковая строка, можно указать несколько раз.')
+        parser.add_argument(
+            '--repeat', type=int, default=200,
+            help='Количество повторов для замера времени.')
+
+    @staticmethod
+    def measure(run, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1_000_000)
+        return statistics.median(timings), max(timings)
+
+    @staticmethod
+    def orm_search(query):
+        """Прежний путь IngredientViewSet.list: фильтр и сериализатор."""
+        queryset = IngredientFilter(
+            {'name': query}, queryset=Ingredient.objects.all()).qs
+        return IngredientSerializer(queryset, many=True).data
+
+    def handle(self, *args, **options):
+        index = IngredientIndex()
+        started = time.perf_counter()
+        index.search('')
+        self.stdout.write(
+            f'{Ingredient.objects.count()} ингредиентов, индекс построен '
+            f'за {(time.perf_counter() - started) * 1000:.1f} ms')
+        repeat = options['repeat']
+        for query in options['queries'] or DEFAULT_QUERIES:
+            index_median, index_max = self.measure(
+                lambda: index.search(query), repeat)
+            orm_median, orm_max = self.measure(
+                lambda: self.orm_search(query), repeat)
+            self.stdout.write(
+                f'{query!r}: index {index_median:.0f} us '
+                f'(max {index_max:.0f}, {len(index.search(query))} шт.), '
+                f'orm {orm_median:.0f} us '
+                f'(max {orm_max:.0f}, {len(self.orm_search(query))} шт.)')
@@ -0,0 +1,120 @@
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.urls import resolve
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.renderers import SHOPPING_LIST_RENDERERS
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, ShoppingCart
+from recipes.utils import recipes_amounts, update_shopping_lists
+from users.models import CustomUser
+
+EXPORT_URL = '/api/recipes/download_shopping_cart/'
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время и пиковую память (tracemalloc) заполнения '
+            'сводного списка покупок и его выгрузки во всех форматах '
+            'для больших корзин. Данные создаются в транзакции, '
+            'которая откатывается после замера.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, nargs='+', default=[1000, 10000],
+            help='Размеры корзины (число рецептов).')
+        parser.add_argument(
+            '--ingredients', type=int, default=5000,
+            help='Количество разных ингредиентов.')
+        parser.add_argument(
+            '--per-recipe', type=int, default=10,
+            help='Количество ингредиентов в рецепте.')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Количество повторов выгрузки для замера времени.')
+
+    @staticmethod
+    def timed(run):
+        """Возвращает результат run() и время выполнения в мс."""
+        started = time.perf_counter()
+        result = run()
+        return result, (time.perf_counter() - started) * 1000
+
+    @staticmethod
+    def peak_memory(run):
+        """Пиковая память, выделенная при выполнении run().
+        Замеряется отдельно: tracemalloc замедляет выполнение."""
+        tracemalloc.start()
+        try:
+            run()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    @staticmethod
+    def fill_cart(count, options):
+        """Создает пользователя с корзиной из count рецептов."""
+        user = CustomUser.objects.create_user(
+            username='benchmark_shopping_list',
+            email='benchmark_shopping_list@example.com')
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'benchmark ингредиент {index}',
+                       measurement_unit='г')
+            for index in range(options['ingredients']))
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=user, name=f'Рецепт {index}',
+                   image='recipes/images/benchmark.png', text='',
+                   cooking_time=1)
+            for index in range(count))
+        per_recipe = min(options['per_recipe'], len(ingredients))
+        generator = random.Random(count)
+        IngredientInRecipe.objects.bulk_create(
+            (IngredientInRecipe(name=recipe, ingredient=ingredient,
+                                amount=generator.randint(1, 500))
+             for recipe in recipes
+             for ingredient in generator.sample(ingredients, per_recipe)),
+            batch_size=5000)
+        ShoppingCart.objects.bulk_create(
+            (ShoppingCart(user=user, recipe=recipe) for recipe in recipes),
+            batch_size=5000)
+        return user, [recipe.pk for recipe in recipes]
+
+    @staticmethod
+    def export(user, format):
+        """Выгружает список покупок через download_shopping_cart
+        и возвращает размер ответа в байтах."""
+        request = APIRequestFactory().get(EXPORT_URL, {'format': format})
+        force_authenticate(request, user)
+        response = resolve(EXPORT_URL).func(request)
+        return sum(len(chunk) for chunk in response.streaming_content)
+
+    def report(self, name, elapsed, peak, extra=''):
+        self.stdout.write(f'  {name}: {elapsed:.1f} ms, '
+                          f'peak {peak / 1024:.0f} KiB{extra}')
+
+    def benchmark(self, count, options):
+        user, recipe_ids = self.fill_cart(count, options)
+        self.stdout.write(f'{count} рецептов в корзине:')
+        amounts, elapsed = self.timed(lambda: recipes_amounts(recipe_ids))
+        _, update_elapsed = self.timed(
+            lambda: update_shopping_lists((user.pk,), amounts))
+        self.report('сводный список', elapsed + update_elapsed,
+                    self.peak_memory(lambda: recipes_amounts(recipe_ids)))
+        for renderer in SHOPPING_LIST_RENDERERS:
+            def export():
+                return self.export(user, renderer.format)
+
+            timings = [self.timed(export)[1]
+                       for _ in range(options['repeat'])]
+            self.report(renderer.format, statistics.median(timings),
+                        self.peak_memory(export),
+                        f', {export() / 1024:.0f} KiB')
+
+    def handle(self, *args, **options):
+        for count in options['recipes']:
+            with transaction.atomic():
+                self.benchmark(count, options)
+                transaction.set_rollback(True)
@@ -0,0 +1,48 @@
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import RecipeNeighbor
+from recipes.recommendations import NeighborBuilder
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает таблицу похожих рецептов для рекомендаций '
+            'по избранному, корзинам, ингредиентам и тегам.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=20,
+            help='Количество соседей для каждого рецепта.')
+        parser.add_argument(
+            '--max-user-items', type=int, default=200,
+            help='Сколько последних рецептов пользователя учитывать.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Количество строк в одном INSERT.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        builder = NeighborBuilder(
+            top_k=options['top_k'],
+            max_user_items=options['max_user_items'])
+        builder.load()
+        self.stdout.write(
+            f'Загружено за {time.monotonic() - started:.1f}s, '
+            f'рецептов: {len(builder.recipe_ids)}')
+        rows = builder.build()
+        created = 0
+        with transaction.atomic():
+            RecipeNeighbor.objects.all().delete()
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                RecipeNeighbor.objects.bulk_create(batch)
+                created += len(batch)
+                self.stdout.write(
+                    f'Сохранено {created} ({time.monotonic() - started:.1f}s)')
+        self.stdout.write(self.style.SUCCESS(
+            f'Built {created} recipe neighbors '
+            f'in {time.monotonic() - started:.1f}s'))
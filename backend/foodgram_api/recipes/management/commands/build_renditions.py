@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from recipes.images import RENDITIONS, build_renditions, recipe_files
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Строит недостающие варианты изображений рецептов: '
+            'задачи фонового пула теряются при перезапуске процесса, '
+            'и такие рецепты отдают оригинал вместо уменьшенных копий.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать рецепты без вариантов.')
+        parser.add_argument(
+            '--check-files', action='store_true',
+            help='Перестраивать и варианты, файлов которых нет '
+                 'в хранилище.')
+
+    @staticmethod
+    def is_stale(recipe, check_files):
+        renditions = recipe.image_renditions
+        if renditions.get('source') != recipe.image.name:
+            return True
+        if not set(RENDITIONS) <= set(renditions):
+            return True
+        storage = recipe.image.storage
+        return check_files and not all(
+            map(storage.exists, recipe_files(None, renditions)))
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'image_renditions').order_by('id')
+        stale = [
+            recipe for recipe in recipes.iterator()
+            if self.is_stale(recipe, options['check_files'])
+        ]
+        for recipe in stale:
+            source = recipe.image.name
+            if not recipe.image.storage.exists(source):
+                self.stderr.write(f'Рецепт {recipe.pk}: нет файла {source}')
+                continue
+            self.stdout.write(f'Рецепт {recipe.pk}: {source}')
+            if not options['dry_run']:
+                build_renditions(recipe.pk, source)
+        self.stdout.write(self.style.SUCCESS(
+            f'Found {len(stale)} recipes without renditions'
+            + ('' if options['dry_run'] else ', rebuilt')))
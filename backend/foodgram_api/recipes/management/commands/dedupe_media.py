@@ -0,0 +1,107 @@
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.images import recipe_files
+from recipes.models import Recipe, StoredFile
+from recipes.storage import is_content_addressed, lock_files
+
+MEDIA_PREFIX = 'recipes'
+
+
+class Command(BaseCommand):
+    help = ('Переносит изображения рецептов в хранилище с именами '
+            'по хешу содержимого (одинаковые файлы сливаются в один), '
+            'удаляет файлы, на которые не ссылается ни один рецепт, '
+            'и пересчитывает счетчики ссылок на файлы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет сделано.')
+
+    def handle(self, *args, **options):
+        self.storage = Recipe._meta.get_field('image').storage
+        self.dry_run = options['dry_run']
+        self.renamed = {}
+        moved = 0
+        for recipe in Recipe.objects.only(
+                'id', 'image', 'image_renditions').iterator():
+            with transaction.atomic():
+                moved += self.rehash_recipe(recipe)
+        removed, freed = self.remove_orphans()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rehashed {moved} recipes, removed {removed} files '
+            f'({freed / 1024 / 1024:.1f} MB)'))
+
+    def rehash(self, name):
+        """Новое имя файла по хешу содержимого."""
+        if name not in self.renamed:
+            if self.dry_run or not self.storage.exists(name):
+                self.renamed[name] = name
+            else:
+                with self.storage.open(name) as file:
+                    self.renamed[name] = self.storage.save(name, file)
+        return self.renamed[name]
+
+    def rehash_recipe(self, recipe):
+        """Переименовывает файлы рецепта. Сохранение через save()
+        освобождает старые файлы и сбрасывает кеши (signals)."""
+        names = [
+            name for name in recipe_files(
+                recipe.image, recipe.image_renditions)
+            if not is_content_addressed(name)]
+        if not names:
+            return 0
+        self.stdout.write(f'Рецепт {recipe.pk}: {", ".join(names)}')
+        if self.dry_run:
+            return 1
+        source = recipe.image.name
+        recipe.image.name = self.rehash(source)
+        recipe.image_renditions = {
+            key: self.rehash(name) if key != 'source' else (
+                recipe.image.name if name == source else name)
+            for key, name in recipe.image_renditions.items()}
+        recipe.save(update_fields=('image', 'image_renditions', 'updated_at'))
+        return 1
+
+    def walk(self, path):
+        directories, files = self.storage.listdir(path)
+        for name in files:
+            yield os.path.join(path, name)
+        for directory in directories:
+            yield from self.walk(os.path.join(path, directory))
+
+    def remove_orphans(self):
+        """Удаляет файлы изображений без ссылок из рецептов."""
+        if not self.storage.exists(MEDIA_PREFIX):
+            return 0, 0
+        referenced = Counter()
+        for image, renditions in Recipe.objects.values_list(
+                'image', 'image_renditions').iterator():
+            referenced.update(recipe_files(image, renditions))
+        if not self.dry_run:
+            self.recount(referenced)
+        removed = freed = 0
+        for name in list(self.walk(MEDIA_PREFIX)):
+            if name in referenced:
+                continue
+            removed += 1
+            freed += self.storage.size(name)
+            self.stdout.write(f'Удаление {name}')
+            if not self.dry_run:
+                self.storage.delete(name)
+        return removed, freed
+
+    @staticmethod
+    @transaction.atomic
+    def recount(referenced):
+        """Приводит счетчики ссылок StoredFile к числу рецептов,
+        которые ссылаются на файл."""
+        files = lock_files(referenced)
+        for file in files:
+            file.references = referenced[file.name]
+        StoredFile.objects.bulk_update(files, ('references',),
+                                       batch_size=1000)
+        StoredFile.objects.exclude(name__in=list(referenced)).delete()
@@ -0,0 +1,125 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from recipes.models import (Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.search import search_recipes, update_search_vectors
+from users.models import CustomUser
+
+SEED_BATCH_SIZE = 10000
+SEED_WORDS = ('молоко', 'мука', 'морковь', 'курица', 'суп', 'свекла',
+              'соль', 'сахар', 'рис', 'картофель')
+
+
+class Command(BaseCommand):
+    help = ('Печатает планы выполнения (EXPLAIN) и время горячих '
+            'запросов на текущих данных или, с --seed, на созданном '
+            'наборе рецептов, который откатывается после замера. '
+            'Запускается до и после миграций с индексами для сравнения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Количество повторов для замера времени.')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Создать столько рецептов (например, 1000000) '
+                 'перед замером и откатить их после.')
+
+    @staticmethod
+    def seed(count):
+        """Создает count рецептов с авторами, тегами, ингредиентами
+        и корзинами пачками по SEED_BATCH_SIZE."""
+        generator = random.Random(count)
+        authors = CustomUser.objects.bulk_create(
+            CustomUser(username=f'seed_{index}',
+                       email=f'seed_{index}@example.com')
+            for index in range(max(1, count // 100)))
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'seed {index}', color=f'#{index:06d}',
+                slug=f'seed-{index}')
+            for index in range(10))
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'{word} {index}', measurement_unit='г')
+            for index in range(200) for word in SEED_WORDS)
+        recipe_tags = Recipe.tags.through
+        for start in range(0, count, SEED_BATCH_SIZE):
+            recipes = Recipe.objects.bulk_create(
+                Recipe(author=generator.choice(authors),
+                       name=f'{generator.choice(SEED_WORDS)} {index}',
+                       image='recipes/images/seed.png',
+                       text=' '.join(generator.choices(SEED_WORDS, k=5)),
+                       cooking_time=generator.randint(1, 120))
+                for index in range(start,
+                                   min(start + SEED_BATCH_SIZE, count)))
+            recipe_tags.objects.bulk_create(
+                recipe_tags(recipe_id=recipe.pk,
+                            tag_id=generator.choice(tags).pk)
+                for recipe in recipes)
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(name=recipe, ingredient=ingredient,
+                                   amount=generator.randint(1, 500))
+                for recipe in recipes
+                for ingredient in generator.sample(ingredients, 5))
+            ShoppingCart.objects.bulk_create(
+                ShoppingCart(user=generator.choice(authors), recipe=recipe)
+                for recipe in recipes[::10])
+            update_search_vectors(recipe.pk for recipe in recipes)
+        if connection.vendor in ('postgresql', 'sqlite'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def hot_queries(self):
+        recipe = Recipe.objects.order_by().first()
+        tag = Tag.objects.order_by().first()
+        cart_item = ShoppingCart.objects.order_by().first()
+        queries = {
+            'recipe feed page':
+                Recipe.objects.order_by('-pub_date', '-id')[:6],
+            'ingredient prefix search':
+                Ingredient.objects.filter(name__istartswith='мол'),
+            'recipe full-text search':
+                search_recipes(Recipe.objects.all(), 'суп курица')[:6],
+        }
+        if recipe is not None:
+            queries['author feed page'] = Recipe.objects.filter(
+                author=recipe.author_id)[:6]
+        if tag is not None:
+            queries['tag feed page'] = Recipe.objects.filter(
+                tags__slug=tag.slug)[:6]
+            queries['tag by slug'] = Tag.objects.filter(slug=tag.slug)
+        if cart_item is not None:
+            queries['shopping cart exists'] = ShoppingCart.objects.filter(
+                user=cart_item.user_id, recipe=cart_item.recipe_id)[:1]
+        return queries
+
+    def handle(self, *args, **options):
+        if not options['seed']:
+            self.explain(options['repeat'])
+            return
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.seed(options['seed'])
+            self.stdout.write(
+                f'Seeded {options["seed"]} recipes in '
+                f'{time.perf_counter() - started:.0f} s')
+            self.explain(options['repeat'])
+            transaction.set_rollback(True)
+
+    def explain(self, repeat):
+        explain_options = (
+            {'analyze': True} if connection.vendor == 'postgresql' else {})
+        for title, queryset in self.hot_queries().items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write(
+                f'median {statistics.median(timings):.3f} ms, '
+                f'max {max(timings):.3f} ms\n')
@@ -1,20 +1,98 @@
+import csv
 import json
 import os
+import time
+from itertools import islice
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from recipes.models import Ingredient
 
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    """Построчно читает пары (название, единица измерения) из CSV."""
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """Потоково читает пары (название, единица измерения)
+    из JSON-массива объектов, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив ингредиентов.')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise CommandError('Файл JSON оборван.')
+            buffer += chunk
+            continue
+        yield item['name'], item['measurement_unit']
+        buffer = buffer[end:]
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
 
 class Command(BaseCommand):
+    help = ('Загружает ингредиенты из CSV или JSON. '
+            'Повторная загрузка не создает дубликатов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=os.path.join(settings.BASE_DIR, 'data/ingredients.json'),
+            help='Путь к файлу .csv или .json.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Количество строк в одном INSERT.')
+
     def handle(self, *args, **options):
-        path = os.path.join(settings.BASE_DIR, 'data/ingredients.json')
-        with open(path, encoding='utf-8') as file:
-            data = json.load(file)
-            for ingredient in data:
-                Ingredient.objects.get_or_create(
-                    name=ingredient['name'],
-                    measurement_unit=ingredient['measurement_unit']
-                )
+        path = options['path']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json.')
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        read = created = 0
+        with open(path, encoding='utf-8') as file, transaction.atomic():
+            seen = set(Ingredient.objects.values_list(
+                'name', 'measurement_unit').iterator())
+            rows = reader(file)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                read += len(batch)
+                new = []
+                for pair in batch:
+                    if pair not in seen:
+                        seen.add(pair)
+                        new.append(Ingredient(
+                            name=pair[0], measurement_unit=pair[1]))
+                Ingredient.objects.bulk_create(
+                    new, batch_size=batch_size, ignore_conflicts=True)
+                created += len(new)
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.stdout.write(
+                    f'Обработано {read}, добавлено {created} '
+                    f'({read / elapsed:.0f} строк/с)')
         self.stdout.write(self.style.SUCCESS(
-            'Successfully entered the data into the database'))
+            f'Successfully entered the data into the database: '
+            f'{created} new of {read} rows '
+            f'in {time.monotonic() - started:.1f}s'))
@@ -0,0 +1,83 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+DEFAULT_PATHS = ('/api/recipes/', '/api/ingredients/?name=са', '/api/tags/')
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест чтения API: для каждого уровня '
+            'конкурентности выводит пропускную способность, p50/p99 '
+            'и долю ошибок. Запускается против синхронного (WSGI) '
+            'и асинхронного (infra/docker-compose.asgi.yml) '
+            'развертывания для сравнения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base-url', default='http://localhost:8000',
+            help='Адрес проверяемого развертывания.')
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Путь запроса, можно указать несколько раз.')
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[10, 50, 100],
+            help='Уровни конкурентности (число одновременных клиентов).')
+        parser.add_argument(
+            '--requests', type=int, default=1000,
+            help='Количество запросов на каждый уровень.')
+        parser.add_argument(
+            '--token', help='Токен авторизации для запросов.')
+        parser.add_argument(
+            '--timeout', type=float, default=10,
+            help='Таймаут одного запроса в секундах.')
+
+    def run_level(self, urls, concurrency, total, headers, timeout):
+        """Выполняет total запросов по кругу из urls
+        в concurrency потоках, каждый со своей сессией."""
+        local = threading.local()
+        timings = []
+        errors = 0
+        lock = threading.Lock()
+
+        def call(index):
+            nonlocal errors
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.headers.update(headers)
+            started = time.perf_counter()
+            try:
+                ok = local.session.get(
+                    urls[index % len(urls)], timeout=timeout).ok
+            except requests.RequestException:
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                timings.append(elapsed)
+                errors += not ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(call, range(total)))
+        return time.perf_counter() - started, timings, errors
+
+    def handle(self, *args, **options):
+        urls = [options['base_url'].rstrip('/') + path
+                for path in options['paths'] or DEFAULT_PATHS]
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        total = max(options['requests'], 2)
+        for concurrency in options['concurrency']:
+            duration, timings, errors = self.run_level(
+                urls, concurrency, total, headers, options['timeout'])
+            percentiles = statistics.quantiles(timings, n=100)
+            self.stdout.write(
+                f'concurrency {concurrency}: '
+                f'{total / duration:.1f} req/s, '
+                f'p50 {statistics.median(timings):.1f} ms, '
+                f'p99 {percentiles[98]:.1f} ms, '
+                f'errors {errors / total:.1%}')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import TimelineEntry
+from recipes.timelines import backfill
+from users.models import Subscription
+
+
+class Command(BaseCommand):
+    help = ('Заполняет ленты подписок заново последними рецептами '
+            'авторов. Нужна после первого развертывания лент.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            TimelineEntry.objects.all().delete()
+            pairs = Subscription.objects.values_list(
+                'user', 'subscription').order_by('user')
+            for number, (user_id, author_id) in enumerate(
+                    pairs.iterator(), 1):
+                backfill(user_id, author_id)
+                if number % 1000 == 0:
+                    self.stdout.write(f'Обработано подписок: {number}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt timelines: {TimelineEntry.objects.count()} entries'))
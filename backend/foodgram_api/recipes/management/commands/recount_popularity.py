@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from recipes.models import Recipe
+from recipes.utils import (POPULARITY_COUNTERS, actual_counters,
+                           popularity_changed)
+
+
+class Command(BaseCommand):
+    help = ('Сверяет счетчики favorites_count и in_carts_count '
+            'с избранным и корзинами и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество рецептов в одном UPDATE.')
+
+    def handle(self, *args, **options):
+        drift = Q()
+        for field in POPULARITY_COUNTERS:
+            drift |= ~Q(**{field: F(f'actual_{field}')})
+        drifted = list(actual_counters().filter(drift).only(
+            'id', *POPULARITY_COUNTERS))
+        for recipe in drifted:
+            for field in POPULARITY_COUNTERS:
+                actual = getattr(recipe, f'actual_{field}')
+                if getattr(recipe, field) != actual:
+                    self.stdout.write(
+                        f'Рецепт {recipe.pk}: {field} '
+                        f'{getattr(recipe, field)} -> {actual}')
+                    setattr(recipe, field, actual)
+        if not options['dry_run']:
+            Recipe.objects.bulk_update(
+                drifted, tuple(POPULARITY_COUNTERS),
+                batch_size=options['batch_size'])
+            if drifted:
+                popularity_changed.send(sender=Recipe)
+        self.stdout.write(self.style.SUCCESS(
+            f'Found {len(drifted)} recipes with drifted counters'
+            + ('' if options['dry_run'] else ', fixed')))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from recipes.trending import rollup
+
+
+class Command(BaseCommand):
+    help = ('Сворачивает добавления в избранное и корзину '
+            'по часам и обновляет оценки трендов рецептов. '
+            'Запускается периодически, например раз в час по cron.')
+
+    def handle(self, *args, **options):
+        created = rollup()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up {created} hourly buckets'))
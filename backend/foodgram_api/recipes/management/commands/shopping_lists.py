@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from recipes.utils import (build_shopping_lists, replace_shopping_list,
+                           stored_shopping_lists)
+
+
+class Command(BaseCommand):
+    help = ('Проверяет сводные списки покупок: строит их заново '
+            'по корзинам и сравнивает с сохраненными.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Перезаписать расходящиеся списки покупок.')
+
+    def handle(self, *args, **options):
+        expected = build_shopping_lists()
+        stored = stored_shopping_lists()
+        mismatched = [
+            user_id for user_id in expected.keys() | stored.keys()
+            if expected.get(user_id, {}) != stored.get(user_id, {})
+        ]
+        for user_id in mismatched:
+            self.stdout.write(
+                f'Пользователь {user_id}: ожидается '
+                f'{expected.get(user_id, {})}, '
+                f'сохранено {stored.get(user_id, {})}')
+            if options['fix']:
+                replace_shopping_list(user_id, expected.get(user_id, {}))
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS(
+                'Shopping lists are consistent'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt {len(mismatched)} shopping lists'))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f'Found {len(mismatched)} inconsistent shopping lists'))
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.1 on 2026-10-18 03:38
+
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Переносит ссылки на дубликаты ингредиента на первый из них.
+    Ограничение уникальности добавляется следующей миграцией:
+    в PostgreSQL ALTER TABLE в одной транзакции с изменением
+    связанных строк падает с ошибкой «pending trigger events»."""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keep=models.Min('id'), total=models.Count('id')
+    ).filter(total__gt=1).order_by()
+    for group in duplicates:
+        others = Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keep'])
+        IngredientInRecipe.objects.filter(ingredient__in=others).update(
+            ingredient_id=group['keep'])
+        for item in ShoppingListItem.objects.filter(ingredient__in=others):
+            kept, _ = ShoppingListItem.objects.get_or_create(
+                user_id=item.user_id, ingredient_id=group['keep'],
+                defaults={'amount': 0})
+            kept.amount += item.amount
+            kept.save()
+            item.delete()
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+    ]
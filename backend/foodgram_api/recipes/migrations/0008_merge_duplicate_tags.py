@@ -0,0 +1,68 @@
+# Generated by Django 4.2.1 on 2026-10-18 03:39
+
+from django.db import migrations, models
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """Переносит рецепты с дубликатов тега на первый из них.
+    Уникальность слага и корзины добавляется следующей миграцией:
+    в PostgreSQL ALTER TABLE в одной транзакции с изменением
+    связанных строк падает с ошибкой «pending trigger events»."""
+    Tag = apps.get_model('recipes', 'Tag')
+    RecipeTag = apps.get_model('recipes', 'Recipe').tags.through
+    duplicates = Tag.objects.values('slug').annotate(
+        keep=models.Min('id'), total=models.Count('id')
+    ).filter(total__gt=1).order_by()
+    for group in duplicates:
+        others = Tag.objects.filter(slug=group['slug']).exclude(
+            id=group['keep'])
+        recipe_ids = set(RecipeTag.objects.filter(tag__in=others).values_list(
+            'recipe_id', flat=True))
+        recipe_ids -= set(RecipeTag.objects.filter(
+            tag_id=group['keep']).values_list('recipe_id', flat=True))
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe_id=recipe_id, tag_id=group['keep'])
+            for recipe_id in recipe_ids
+        )
+        others.delete()
+
+
+def remove_duplicate_cart_items(apps, schema_editor):
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = ShoppingCart.objects.values('user', 'recipe').annotate(
+        keep=models.Min('id'), total=models.Count('id')
+    ).filter(total__gt=1).order_by()
+    user_ids = set()
+    for group in duplicates:
+        ShoppingCart.objects.filter(
+            user=group['user'], recipe=group['recipe']
+        ).exclude(id=group['keep']).delete()
+        user_ids.add(group['user'])
+    if not user_ids:
+        return
+    ShoppingListItem.objects.filter(user__in=user_ids).delete()
+    rows = IngredientInRecipe.objects.filter(
+        name__recipe_in_cart__user__in=user_ids
+    ).values_list('name__recipe_in_cart__user', 'ingredient').annotate(
+        total=models.Sum('amount')).order_by()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                         amount=amount)
+        for user_id, ingredient_id, amount in rows.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_ingredient_name_measurement_unit'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags,
+                             migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicate_cart_items,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.1 on 2026-10-18 03:39
+
+from django.db import migrations, models
+
+INGREDIENT_NAME_INDEX = 'ingredient_name_upper_idx'
+
+
+def create_ingredient_name_index(apps, schema_editor):
+    """Индекс для поиска по началу названия без учета регистра.
+    Django строит для istartswith условие
+    UPPER("name"::text) LIKE UPPER(...), которое использует индекс
+    только по тому же выражению с классом операторов text_pattern_ops,
+    поэтому индекс создается лишь в PostgreSQL."""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {INGREDIENT_NAME_INDEX} '
+            f'ON recipes_ingredient ((UPPER(name::text)) text_pattern_ops)')
+
+
+def drop_ingredient_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'DROP INDEX IF EXISTS {INGREDIENT_NAME_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_merge_duplicate_tags'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tag',
+            name='slug',
+            field=models.SlugField(max_length=200, unique=True, verbose_name='Слаг'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipe_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='cart_user_recipe'),
+        ),
+        migrations.RunPython(create_ingredient_name_index,
+                             drop_ingredient_name_index),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.1 on 2026-10-18 03:52
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR_INDEX = 'recipe_search_vector_idx'
+FTS_TABLE = 'recipes_recipe_fts'
+VECTOR_SQL = '''
+    setweight(to_tsvector('russian', coalesce(r.name, '')), 'A')
+    || setweight(to_tsvector('russian', coalesce((
+        SELECT string_agg(i.name, ' ')
+        FROM recipes_ingredientinrecipe ir
+        JOIN recipes_ingredient i ON i.id = ir.ingredient_id
+        WHERE ir.name_id = r.id), '')), 'B')
+    || setweight(to_tsvector('russian', coalesce(r.text, '')), 'C')
+'''
+
+
+def create_search_index(apps, schema_editor):
+    """GIN-индекс по вектору в PostgreSQL или таблица FTS5 в SQLite,
+    заполняются по существующим рецептам."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f'UPDATE recipes_recipe r SET search_vector = {VECTOR_SQL}')
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {SEARCH_VECTOR_INDEX} '
+            f'ON recipes_recipe USING GIN (search_vector)')
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+            f'USING fts5(name, ingredients, text, '
+            f"tokenize='unicode61 remove_diacritics 2')")
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+            f'SELECT r.id, r.name, coalesce(('
+            f"SELECT group_concat(i.name, ' ') "
+            f'FROM recipes_ingredientinrecipe ir '
+            f'JOIN recipes_ingredient i ON i.id = ir.ingredient_id '
+            f"WHERE ir.name_id = r.id), ''), r.text FROM recipes_recipe r")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {SEARCH_VECTOR_INDEX}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
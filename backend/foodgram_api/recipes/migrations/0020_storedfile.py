@@ -0,0 +1,50 @@
+# Generated by Django 4.2.1 on 2026-10-18 04:54
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_stored_files(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    StoredFile = apps.get_model('recipes', 'StoredFile')
+    references = Counter()
+    renditions = {}
+    for image, image_renditions in Recipe.objects.values_list(
+            'image', 'image_renditions').iterator():
+        names = {name for key, name in image_renditions.items()
+                 if key != 'source'}
+        if image:
+            names.add(image)
+            if image_renditions.get('source') == image:
+                renditions[image] = image_renditions
+        references.update(names)
+    StoredFile.objects.bulk_create(
+        (StoredFile(name=name, references=count,
+                    renditions=renditions.get(name, {}))
+         for name, count in references.items()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_timeline_recipe_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Число ссылок')),
+                ('renditions', models.JSONField(default=dict, verbose_name='Варианты изображения')),
+            ],
+            options={
+                'verbose_name': 'Файл',
+                'verbose_name_plural': 'Файлы',
+            },
+        ),
+        migrations.RunPython(fill_stored_files, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from recipes.storage import ContentAddressedStorage
 from users.models import CustomUser
 
 
@@ -12,7 +14,7 @@ class Tag(models.Model):
                                      '^#([A-Fa-f0-9]{6}|[A-Fa-f0-9]{3})$',
                                      message='Неверное значение формата HEX'
                                  )])
-    slug = models.SlugField('Слаг', max_length=200)
+    slug = models.SlugField('Слаг', max_length=200, unique=True)
 
     class Meta:
         verbose_name = 'Тег'
@@ -31,6 +33,11 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'measurement_unit'],
+                                    name='name_measurement_unit'
+                                    )
+        ]
 
     def __str__(self):
         return self.name
@@ -43,7 +50,10 @@ class Recipe(models.Model):
         verbose_name='Автор', related_name='recipes'
     )
     name = models.CharField('Название', max_length=200)
-    image = models.ImageField('Изображение', upload_to='recipes/images/')
+    image = models.ImageField('Изображение', upload_to='recipes/images/',
+                              storage=ContentAddressedStorage())
+    image_renditions = models.JSONField(
+        'Варианты изображения', default=dict, blank=True, editable=False)
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(Ingredient,
                                          through='IngredientInRecipe',
@@ -58,11 +68,32 @@ class Recipe(models.Model):
         default=1
     )
     pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+    search_vector = SearchVectorField(
+        'Поисковый вектор', null=True, editable=False)
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField(
+        'В корзинах', default=0, editable=False)
+    trending_score = models.FloatField(
+        'Популярность за последнее время', default=0, editable=False)
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['updated_at'],
+                         name='recipe_updated_at_idx'),
+            models.Index(fields=['-favorites_count', '-pub_date', '-id'],
+                         name='recipe_popular_idx'),
+            models.Index(fields=['-trending_score', '-pub_date', '-id'],
+                         name='recipe_trending_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -96,15 +127,47 @@ class ShoppingCart(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
                                related_name='recipe_in_cart',
                                verbose_name='Рецепт')
+    created_at = models.DateTimeField('Дата добавления', auto_now_add=True,
+                                      db_index=True)
 
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='cart_user_recipe'
+                                    )
+        ]
 
     def __str__(self):
         return f'{self.user} добавил в корзину {self.recipe}'
 
 
+class ShoppingListItem(models.Model):
+    """Модель сводного списка покупок.
+    Хранит суммарное количество ингредиента по всем рецептам
+    в корзине пользователя и обновляется при изменении корзины."""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE,
+                             related_name='shopping_list',
+                             verbose_name='Пользователь')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE,
+                                   related_name='in_shopping_lists',
+                                   verbose_name='Ингредиент')
+    amount = models.IntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Сводный список покупок'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ingredient'],
+                                    name='user_ingredient'
+                                    )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} для {self.user}: {self.amount}'
+
+
 class Favorites(models.Model):
     """Модель избранного."""
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE,
@@ -113,6 +176,8 @@ class Favorites(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
                                related_name='recipe_in_favorites',
                                verbose_name='Рецепт')
+    created_at = models.DateTimeField('Дата добавления', auto_now_add=True,
+                                      db_index=True)
 
     class Meta:
         verbose_name = 'Избранное'
@@ -125,3 +190,98 @@ class Favorites(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил в избранное {self.recipe}'
+
+
+class RecipeNeighbor(models.Model):
+    """Модель похожего рецепта для рекомендаций.
+    Для каждого рецепта хранится top-K соседей с оценкой сходства,
+    таблица пересчитывается командой build_recommendations."""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='neighbors',
+                               verbose_name='Рецепт')
+    neighbor = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                                 related_name='+',
+                                 verbose_name='Похожий рецепт')
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'neighbor'],
+                                    name='recipe_neighbor'
+                                    )
+        ]
+
+    def __str__(self):
+        return f'{self.neighbor} похож на {self.recipe}: {self.score:.3f}'
+
+
+class EngagementBucket(models.Model):
+    """Модель почасовой статистики добавлений рецепта
+    в избранное и корзину, заполняется командой rollup_trending."""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='engagement',
+                               verbose_name='Рецепт')
+    hour = models.DateTimeField('Час', db_index=True)
+    favorites = models.PositiveIntegerField('В избранное', default=0)
+    carts = models.PositiveIntegerField('В корзину', default=0)
+
+    class Meta:
+        verbose_name = 'Активность за час'
+        verbose_name_plural = 'Активность по часам'
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'hour'],
+                                    name='recipe_hour'
+                                    )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} за {self.hour:%Y-%m-%d %H}:00'
+
+
+class TimelineEntry(models.Model):
+    """Модель записи ленты подписок пользователя.
+    Новые рецепты раскладываются по лентам подписчиков автора
+    при публикации (recipes.timelines)."""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE,
+                             related_name='timeline',
+                             verbose_name='Пользователь')
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='timeline_entries',
+                               verbose_name='Рецепт')
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='timeline_user_recipe'
+                                    )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='timeline_user_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
+
+
+class StoredFile(models.Model):
+    """Модель файла изображения в хранилище по хешу содержимого.
+    references - число рецептов, которые ссылаются на файл
+    (изображением или его вариантом), renditions - построенные
+    для изображения варианты. Счетчик меняется и файл удаляется
+    под блокировкой строки (recipes.images)."""
+    name = models.CharField('Имя файла', max_length=255, unique=True)
+    references = models.PositiveIntegerField('Число ссылок', default=0)
+    renditions = models.JSONField('Варианты изображения', default=dict)
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,180 @@
+import heapq
+from array import array
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+
+from recipes.models import (Favorites, IngredientInRecipe, Recipe,
+                            RecipeNeighbor, ShoppingCart)
+
+CO_WEIGHT = 1.0
+INGREDIENT_WEIGHT = 0.5
+TAG_WEIGHT = 0.2
+CHUNK_SIZE = 10000
+BLOCK_SIZE = 1000
+
+
+def latest_ids(entries, limit):
+    """limit id из пар (дата добавления, id), добавленных последними.
+    Рецепт и в избранном, и в корзине учитывается по последней дате."""
+    added = {}
+    for created_at, recipe_id in entries:
+        if recipe_id not in added or added[recipe_id] < created_at:
+            added[recipe_id] = created_at
+    return heapq.nlargest(limit, added, key=added.get)
+
+
+def recent_recipe_ids(user, limit):
+    """id рецептов, последними добавленных пользователем
+    в избранное или корзину, от новых к старым."""
+    entries = []
+    for model in (Favorites, ShoppingCart):
+        entries.extend(model.objects.filter(user=user).order_by(
+            '-created_at').values_list('created_at', 'recipe')[:limit])
+    return latest_ids(entries, limit)
+
+
+class NeighborBuilder:
+    """Расчет похожих рецептов для таблицы RecipeNeighbor.
+    Сходство - взвешенная сумма косинусов по пользователям,
+    добавившим оба рецепта в избранное или корзину, по общим
+    ингредиентам и по общим тегам. Данные загружаются в разреженные
+    матрицы рецепты × признаки (scipy.sparse), число общих признаков
+    считается произведением X·Xᵀ блоками по block_size рецептов,
+    хранится только top-K каждого рецепта. Число рецептов
+    пользователя ограничено max_user_items последними, ингредиенты,
+    входящие в долю рецептов больше common_share (соль, вода),
+    в сходстве не учитываются."""
+
+    def __init__(self, top_k=20, max_user_items=200, common_share=0.05,
+                 block_size=BLOCK_SIZE):
+        self.top_k = top_k
+        self.max_user_items = max_user_items
+        self.common_share = common_share
+        self.block_size = block_size
+
+    def load(self):
+        entries_of = defaultdict(list)
+        for model in (Favorites, ShoppingCart):
+            for user_id, created_at, recipe_id in model.objects.values_list(
+                    'user', 'created_at', 'recipe').iterator(
+                        chunk_size=CHUNK_SIZE):
+                entries_of[user_id].append((created_at, recipe_id))
+        self.recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        self.position = {
+            recipe_id: index for index, recipe_id in enumerate(self.recipe_ids)
+        }
+        self.users = self.incidence(
+            (recipe_id, user_id) for user_id, entries in entries_of.items()
+            for recipe_id in latest_ids(entries, self.max_user_items))
+        ingredients = self.incidence(
+            IngredientInRecipe.objects.values_list(
+                'name', 'ingredient').iterator(chunk_size=CHUNK_SIZE))
+        common_limit = max(1, int(len(self.recipe_ids) * self.common_share))
+        self.ingredients = ingredients[
+            :, ingredients.getnnz(axis=0) <= common_limit]
+        self.tags = self.incidence(
+            Recipe.tags.through.objects.values_list(
+                'recipe', 'tag').iterator(chunk_size=CHUNK_SIZE))
+        # Косинус считается по полному числу признаков рецепта,
+        # в том числе отброшенных частых ингредиентов.
+        self.user_norms = self.inverse_norms(self.users)
+        self.ingredient_norms = self.inverse_norms(ingredients)
+        self.tag_norms = self.inverse_norms(self.tags)
+
+    def incidence(self, pairs):
+        """Бинарная матрица рецепты × признаки из пар
+        (id рецепта, id признака)."""
+        rows, columns, column_of = array('q'), array('q'), {}
+        for recipe_id, feature_id in pairs:
+            if recipe_id in self.position:
+                rows.append(self.position[recipe_id])
+                columns.append(
+                    column_of.setdefault(feature_id, len(column_of)))
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows)), (np.frombuffer(rows, dtype=np.int64),
+                                  np.frombuffer(columns, dtype=np.int64))),
+            shape=(len(self.recipe_ids), len(column_of)))
+        matrix.data[:] = 1
+        return matrix
+
+    @staticmethod
+    def inverse_norms(matrix):
+        counts = matrix.getnnz(axis=1)
+        norms = np.zeros(len(counts))
+        np.divide(1, np.sqrt(counts), out=norms, where=counts > 0)
+        return norms
+
+    @staticmethod
+    def cosine(matrix, norms, rows):
+        """Косинусы рецептов rows со всеми рецептами."""
+        common = matrix[rows] @ matrix.T
+        return sparse.diags(norms[rows]) @ common @ sparse.diags(norms)
+
+    @staticmethod
+    def top(values, count):
+        """Индексы count наибольших значений по убыванию."""
+        if len(values) > count:
+            values_order = np.argpartition(-values, count)[:count]
+        else:
+            values_order = np.arange(len(values))
+        return values_order[np.argsort(-values[values_order], kind='stable')]
+
+    def candidates(self, rows):
+        """4·top_k лучших пар блока по избранному и ингредиентам:
+        массивы строк, столбцов и оценок."""
+        scores = (
+            CO_WEIGHT * self.cosine(self.users, self.user_norms, rows)
+            + INGREDIENT_WEIGHT * self.cosine(
+                self.ingredients, self.ingredient_norms, rows)
+        ).tocsr()
+        pairs = []
+        for offset, row in enumerate(rows):
+            begin, end = scores.indptr[offset], scores.indptr[offset + 1]
+            columns = scores.indices[begin:end]
+            values = scores.data[begin:end]
+            other = (columns != row) & (values > 0)
+            columns, values = columns[other], values[other]
+            best = self.top(values, 4 * self.top_k)
+            pairs.append((np.full(len(best), row), columns[best],
+                          values[best]))
+        return [np.concatenate(part) for part in zip(*pairs)]
+
+    def neighbors(self, rows):
+        """Возвращает тройки (строка, строка соседа, сходство),
+        top-K для каждого рецепта блока."""
+        pair_rows, pair_columns, values = self.candidates(rows)
+        shared_tags = np.asarray(self.tags[pair_rows].multiply(
+            self.tags[pair_columns]).sum(axis=1)).ravel()
+        values = values + TAG_WEIGHT * (
+            shared_tags * self.tag_norms[pair_rows]
+            * self.tag_norms[pair_columns])
+        bounds = np.searchsorted(pair_rows, rows, side='right')
+        begin = 0
+        for end in bounds:
+            best = begin + self.top(values[begin:end], self.top_k)
+            yield from zip(pair_rows[best], pair_columns[best], values[best])
+            begin = end
+
+    def build(self):
+        """Генерирует строки RecipeNeighbor для всех рецептов."""
+        for start in range(0, len(self.recipe_ids), self.block_size):
+            rows = np.arange(
+                start, min(start + self.block_size, len(self.recipe_ids)))
+            for row, other, score in self.neighbors(rows):
+                yield RecipeNeighbor(
+                    recipe_id=self.recipe_ids[row],
+                    neighbor_id=self.recipe_ids[other], score=float(score))
+
+
+def recommend(seed_ids, exclude_ids=()):
+    """Ранжирует рецепты, похожие на seed_ids, по сумме сходства
+    с ними. Возвращает список id без exclude_ids."""
+    scores = defaultdict(float)
+    for neighbor_id, score in RecipeNeighbor.objects.filter(
+            recipe__in=seed_ids).values_list('neighbor', 'score'):
+        scores[neighbor_id] += score
+    for recipe_id in exclude_ids:
+        scores.pop(recipe_id, None)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,97 @@
+import re
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F
+
+from recipes.models import IngredientInRecipe, Recipe
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+WORD = re.compile(r'\w+')
+
+# Поисковый вектор рецепта в PostgreSQL: название (вес A),
+# названия ингредиентов (B) и описание (C) с русским стеммингом.
+VECTOR_SQL = f'''
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(r.name, '')), 'A')
+    || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce((
+        SELECT string_agg(i.name, ' ')
+        FROM recipes_ingredientinrecipe ir
+        JOIN recipes_ingredient i ON i.id = ir.ingredient_id
+        WHERE ir.name_id = r.id), '')), 'B')
+    || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(r.text, '')), 'C')
+'''
+
+
+def update_search_vectors(recipe_ids):
+    """Пересчитывает поисковые данные рецептов recipe_ids.
+    В PostgreSQL это столбец search_vector с GIN-индексом,
+    в SQLite - виртуальная таблица FTS5 (для локального запуска)."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE recipes_recipe r SET search_vector = {VECTOR_SQL} '
+                f'WHERE r.id = ANY(%s)', [recipe_ids])
+    elif connection.vendor == 'sqlite':
+        update_fts_rows(recipe_ids)
+
+
+def update_fts_rows(recipe_ids):
+    ingredients = defaultdict(list)
+    for recipe_id, name in IngredientInRecipe.objects.filter(
+            name__in=recipe_ids).values_list('name', 'ingredient__name'):
+        ingredients[recipe_id].append(name)
+    rows = [
+        (recipe_id, name, ' '.join(ingredients[recipe_id]), text)
+        for recipe_id, name, text in Recipe.objects.filter(
+            id__in=recipe_ids).values_list('id', 'name', 'text')
+    ]
+    delete_fts_rows(recipe_ids)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+            f'VALUES (%s, %s, %s, %s)', rows)
+
+
+def delete_fts_rows(recipe_ids):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(recipe_id,) for recipe_id in recipe_ids])
+
+
+def fts_query(query):
+    """Запрос FTS5: все слова как префиксы, вместо стемминга."""
+    return ' '.join(f'"{word}"*' for word in WORD.findall(query.lower()))
+
+
+def search_recipes(queryset, query):
+    """Отбирает рецепты по поисковому запросу и сортирует
+    по релевантности, при равной - по дате публикации."""
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch')
+        queryset = queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query))
+    elif connection.vendor == 'sqlite':
+        match = fts_query(query)
+        if not match:
+            return queryset.none()
+        # Соединение с таблицей FTS5, а не подзапрос с bm25
+        # для каждой строки: коррелированный подзапрос выполнял
+        # MATCH заново на каждый найденный рецепт.
+        queryset = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = recipes_recipe.id',
+                   f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'-bm25({FTS_TABLE}, 10.0, 4.0, 1.0)'})
+    else:
+        return queryset.filter(name__icontains=query)
+    return queryset.order_by('-search_rank', '-pub_date', '-id')
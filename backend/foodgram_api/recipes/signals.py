@@ -0,0 +1,109 @@
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from recipes.images import (acquire_files, recipe_files, release_files,
+                            schedule_renditions)
+from recipes.models import (Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart)
+from recipes.search import delete_fts_rows, update_search_vectors
+from recipes.timelines import backfill, fan_out, unfollow
+from recipes.utils import recipe_amounts, update_shopping_lists
+from users.models import Subscription
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    """Вычитает удаляемый рецепт из сводных списков покупок
+    до каскадного удаления записей корзины."""
+    update_shopping_lists(
+        ShoppingCart.objects.filter(recipe=instance).values_list(
+            'user', flat=True),
+        {key: -value for key, value in recipe_amounts(instance).items()})
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_image_files(sender, instance, **kwargs):
+    """Запоминает файлы изображения рецепта до сохранения."""
+    old = Recipe.objects.filter(pk=instance.pk).values(
+        'image', 'image_renditions').first() if instance.pk else None
+    instance._old_files = recipe_files(
+        old['image'], old['image_renditions']) if old else set()
+
+
+@receiver(post_save, sender=Recipe)
+def build_image_renditions(sender, instance, **kwargs):
+    """Запускает обработку изображения, если оно сменилось,
+    добавляет ссылки на новые файлы рецепта и после фиксации
+    освобождает файлы, которые он больше не использует."""
+    source = instance.image_renditions.get('source')
+    if instance.image and source != instance.image.name:
+        schedule_renditions(instance)
+    files = recipe_files(instance.image, instance.image_renditions)
+    acquire_files(files - instance._old_files)
+    released = instance._old_files - files
+    if released:
+        transaction.on_commit(
+            lambda: release_files(instance.image.storage, released))
+
+
+@receiver(post_delete, sender=Recipe)
+def release_image_files(sender, instance, **kwargs):
+    """Освобождает файлы изображения удаленного рецепта."""
+    files = recipe_files(instance.image, instance.image_renditions)
+    transaction.on_commit(
+        lambda: release_files(instance.image.storage, files))
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, update_fields=None,
+                                **kwargs):
+    """Пересчитывает поисковый вектор при изменении названия
+    или описания. Ингредиенты обновляет create_update_ing."""
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        update_search_vectors([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_search_row(sender, instance, **kwargs):
+    delete_fts_rows([instance.pk])
+
+
+@receiver(pre_delete, sender=Ingredient)
+def remember_ingredient_recipes(sender, instance, **kwargs):
+    instance._recipe_ids = list(IngredientInRecipe.objects.filter(
+        ingredient=instance).values_list('name', flat=True))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def update_ingredient_search_vectors(sender, instance, created=False,
+                                     **kwargs):
+    """Переименование или удаление ингредиента меняет
+    поисковые векторы рецептов, в которые он входит."""
+    if created:
+        return
+    recipe_ids = getattr(instance, '_recipe_ids', None)
+    if recipe_ids is None:
+        recipe_ids = IngredientInRecipe.objects.filter(
+            ingredient=instance).values_list('name', flat=True)
+    update_search_vectors(recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    """Раскладывает новый рецепт по лентам подписчиков."""
+    if created:
+        transaction.on_commit(lambda: fan_out(instance))
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        backfill(instance.user_id, instance.subscription_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def clear_timeline(sender, instance, **kwargs):
+    unfollow(instance.user_id, instance.subscription_id)
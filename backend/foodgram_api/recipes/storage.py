@@ -0,0 +1,72 @@
+import hashlib
+import os
+import re
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+CONTENT_ADDRESSED_NAME = re.compile(r'(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}\.')
+
+
+def content_hash(content):
+    """SHA-256 содержимого файла, читаемого частями."""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def is_content_addressed(name):
+    return CONTENT_ADDRESSED_NAME.search(name) is not None
+
+
+def lock_files(names):
+    """Блокирует строки файлов names (создавая недостающие)
+    до конца текущей транзакции и возвращает их."""
+    model = apps.get_model('recipes', 'StoredFile')
+    names = sorted(set(names))
+    existing = set(model.objects.filter(
+        name__in=names).values_list('name', flat=True))
+    model.objects.bulk_create(
+        [model(name=name) for name in names if name not in existing],
+        ignore_conflicts=True)
+    return list(model.objects.select_for_update().filter(
+        name__in=names).order_by('name'))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла - хеш его содержимого:
+    <каталог upload_to>/<2 символа хеша>/<хеш>.<расширение>.
+    Одинаковые загрузки сохраняются на диск один раз, а содержимое
+    файла под данным именем никогда не меняется, поэтому nginx
+    отдает /media/ с бессрочным кешированием (immutable).
+    Файл может использоваться несколькими рецептами, удалять его
+    можно только через recipes.images.release_files. Сохранение
+    блокирует строку файла до конца транзакции: файл, который уже
+    есть на диске, не будет удален, пока рецепт не добавит ссылку
+    на него, а удаленный до блокировки записывается заново."""
+
+    def hashed_name(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = content_hash(content)
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        with transaction.atomic():
+            lock_files([name])
+            if self.exists(name):
+                return name
+            return super().save(name, content, max_length)
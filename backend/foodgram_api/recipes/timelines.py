@@ -0,0 +1,117 @@
+import random
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+
+from recipes.models import Recipe, TimelineEntry
+from users.models import Subscription
+
+TIMELINE_LENGTH = 1000
+TIMELINE_SLACK = 100
+BACKFILL_SIZE = 50
+FANOUT_LIMIT = 5000
+PULL_THRESHOLD = FANOUT_LIMIT // 2
+PULL_AUTHORS_KEY = 'timelines:pull_authors'
+PULL_AUTHORS_TIMEOUT = 10 * 60
+BATCH_SIZE = 1000
+PULL_INTERVAL = 60
+PULLED_KEY = 'timelines:pulled:{}'
+# recipe_id, а не recipe: сортировка по связи добавила бы JOIN
+# и Recipe.Meta.ordering, и индекс ленты не использовался бы.
+FEED_ORDERING = ('-pub_date', '-recipe_id')
+
+# Ленты подписок строятся при записи: новый рецепт добавляется
+# в ленты всех подписчиков автора. У авторов с числом подписчиков
+# больше FANOUT_LIMIT рецепты не раскладываются, а добавляются в ленту
+# подписчика при ее чтении (pull). Порог чтения ниже порога записи,
+# поэтому автор, чье число подписчиков колеблется около порога,
+# не пропадает из лент.
+
+
+def entries(user_ids, recipes):
+    return [
+        TimelineEntry(user_id=user_id, recipe_id=recipe.pk,
+                      pub_date=recipe.pub_date)
+        for user_id in user_ids for recipe in recipes
+    ]
+
+
+def trim_timeline(user_id):
+    """Оставляет в ленте пользователя TIMELINE_LENGTH новых записей."""
+    old = TimelineEntry.objects.filter(user=user_id).order_by(
+        *FEED_ORDERING).values_list('id', flat=True)[TIMELINE_LENGTH:]
+    TimelineEntry.objects.filter(id__in=list(old)).delete()
+
+
+def fan_out(recipe):
+    """Добавляет рецепт в ленты подписчиков автора.
+    Ленты обрезаются выборочно: каждая с вероятностью
+    1/TIMELINE_SLACK, поэтому в среднем лента длиннее
+    TIMELINE_LENGTH не более чем на TIMELINE_SLACK записей."""
+    follower_ids = list(Subscription.objects.filter(
+        subscription=recipe.author_id).values_list(
+        'user', flat=True)[:FANOUT_LIMIT + 1])
+    if len(follower_ids) > FANOUT_LIMIT:
+        return
+    TimelineEntry.objects.bulk_create(
+        entries(follower_ids, [recipe]),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+    for user_id in follower_ids:
+        if random.random() < 1 / TIMELINE_SLACK:
+            trim_timeline(user_id)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние рецепты нового автора подписки."""
+    recipes = Recipe.objects.filter(author=author_id).order_by(
+        '-pub_date', '-id').only('id', 'pub_date')[:BACKFILL_SIZE]
+    TimelineEntry.objects.bulk_create(
+        entries([user_id], recipes), ignore_conflicts=True)
+
+
+def unfollow(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user=user_id, recipe__author=author_id).delete()
+
+
+def pull_authors():
+    """Авторы, рецепты которых подмешиваются в ленты при чтении."""
+    return cache.get_or_set(
+        PULL_AUTHORS_KEY,
+        lambda: frozenset(Subscription.objects.values(
+            'subscription').annotate(total=Count('id')).filter(
+            total__gt=PULL_THRESHOLD).values_list(
+            'subscription', flat=True).order_by()),
+        PULL_AUTHORS_TIMEOUT)
+
+
+def pull(user_id, author_ids):
+    """Добавляет в ленту пользователя рецепты авторов author_ids,
+    вышедшие не раньше последнего рецепта каждого из них в ленте."""
+    latest = dict(TimelineEntry.objects.filter(
+        user=user_id, recipe__author__in=author_ids).values_list(
+        'recipe__author').annotate(latest=Max('pub_date')).order_by())
+    condition = Q()
+    for author_id in author_ids:
+        if author_id in latest:
+            condition |= Q(author=author_id, pub_date__gte=latest[author_id])
+        else:
+            condition |= Q(author=author_id)
+    recipes = Recipe.objects.filter(condition).order_by(
+        '-pub_date', '-id').only('id', 'pub_date')[:TIMELINE_LENGTH]
+    TimelineEntry.objects.bulk_create(
+        entries([user_id], recipes), ignore_conflicts=True)
+    if len(recipes) > TIMELINE_SLACK or random.random() < 1 / TIMELINE_SLACK:
+        trim_timeline(user_id)
+
+
+def feed(user, subscription_ids):
+    """Записи ленты подписок пользователя в порядке FEED_ORDERING,
+    который совпадает с индексом timeline_user_pub_date_idx.
+    Рецепты популярных авторов из subscription_ids добавляются
+    в ленту перед чтением, не чаще раза в PULL_INTERVAL секунд."""
+    pulled = pull_authors().intersection(subscription_ids)
+    if pulled and cache.add(PULLED_KEY.format(user.pk), True,
+                            PULL_INTERVAL):
+        pull(user.pk, pulled)
+    return TimelineEntry.objects.filter(user=user).order_by(*FEED_ORDERING)
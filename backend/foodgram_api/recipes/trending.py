@@ -0,0 +1,82 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from math import log2
+
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from recipes.models import EngagementBucket, Favorites, Recipe, ShoppingCart
+from recipes.utils import popularity_changed
+
+HALF_LIFE = timedelta(hours=24)
+CART_WEIGHT = 0.5
+ROLLUP_DELAY = timedelta(minutes=5)
+ROLLUP_HORIZON = timedelta(days=7)
+SCORE_EPOCH = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+EVENT_MODELS = {'favorites': Favorites, 'carts': ShoppingCart}
+
+
+def log_weight(hour, weight):
+    """log2 вклада weight событий часа hour в оценку.
+    Оценка хранится как log2(сумма weight * 2^((час - эпоха)/полураспад)):
+    порядок рецептов такой же, как у суммы с экспоненциальным
+    затуханием от текущего момента, но старые значения не нужно
+    пересчитывать - новые часы просто добавляются."""
+    return log2(weight) + (hour - SCORE_EPOCH) / HALF_LIFE
+
+
+def log_add(left, right):
+    """log2(2^left + 2^right), 0 - отсутствие оценки."""
+    if not left:
+        return right
+    high, low = max(left, right), min(left, right)
+    return high + log2(1 + 2 ** (low - high))
+
+
+def hourly_counts(since, until):
+    """Число добавлений в избранное и корзину по рецептам и часам."""
+    buckets = defaultdict(dict)
+    for field, model in EVENT_MODELS.items():
+        rows = model.objects.filter(
+            created_at__gte=since, created_at__lt=until
+        ).annotate(hour=TruncHour('created_at')).values_list(
+            'recipe', 'hour').annotate(total=Count('id')).order_by()
+        for recipe_id, hour, total in rows.iterator():
+            buckets[recipe_id, hour][field] = total
+    return buckets
+
+
+def rollup(now=None):
+    """Сворачивает завершенные часы после последнего свернутого
+    в EngagementBucket и добавляет их вклад в Recipe.trending_score.
+    Часы сворачиваются с задержкой ROLLUP_DELAY, чтобы успели
+    зафиксироваться транзакции, начатые до конца часа.
+    Возвращает количество новых почасовых записей."""
+    until = ((now or timezone.now()) - ROLLUP_DELAY).replace(
+        minute=0, second=0, microsecond=0)
+    last = EngagementBucket.objects.aggregate(hour=Max('hour'))['hour']
+    since = last + timedelta(hours=1) if last else until - ROLLUP_HORIZON
+    if since >= until:
+        return 0
+    buckets = hourly_counts(since, until)
+    scores = defaultdict(float)
+    for (recipe_id, hour), counts in buckets.items():
+        weight = counts.get('favorites', 0) + CART_WEIGHT * counts.get(
+            'carts', 0)
+        scores[recipe_id] = log_add(
+            scores[recipe_id], log_weight(hour, weight))
+    with transaction.atomic():
+        EngagementBucket.objects.bulk_create(
+            EngagementBucket(recipe_id=recipe_id, hour=hour, **counts)
+            for (recipe_id, hour), counts in buckets.items())
+        recipes = list(Recipe.objects.select_for_update().filter(
+            pk__in=scores).only('id', 'trending_score'))
+        for recipe in recipes:
+            recipe.trending_score = log_add(
+                recipe.trending_score, scores[recipe.pk])
+        Recipe.objects.bulk_update(recipes, ('trending_score',),
+                                   batch_size=1000)
+        popularity_changed.send(sender=Recipe)
+    return len(buckets)
@@ -0,0 +1,175 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.dispatch import Signal
+
+from recipes.models import (Favorites, IngredientInRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem)
+from users.models import CustomUser
+
+POPULAR_ORDERING = ('-favorites_count', '-pub_date', '-id')
+TRENDING_ORDERING = ('-trending_score', '-pub_date', '-id')
+POPULARITY_COUNTERS = {
+    'favorites_count': Favorites,
+    'in_carts_count': ShoppingCart,
+}
+
+# Счетчики популярности или оценки трендов изменены запросом UPDATE
+# в обход save(); получатель сбрасывает закешированные списки
+# с ordering=popular и trending (api/signals.py).
+popularity_changed = Signal()
+
+
+def recipe_amounts(recipe):
+    """Возвращает количество каждого ингредиента рецепта
+    в виде словаря {id ингредиента: количество}."""
+    return dict(
+        IngredientInRecipe.objects.filter(name=recipe).values_list(
+            'ingredient').annotate(total=Sum('amount')).order_by()
+    )
+
+
+def recipes_amounts(recipe_ids):
+    """Суммарное количество ингредиентов нескольких рецептов
+    в виде словаря {id ингредиента: количество}."""
+    return dict(
+        IngredientInRecipe.objects.filter(name__in=recipe_ids).values_list(
+            'ingredient').annotate(total=Sum('amount')).order_by()
+    )
+
+
+def lock_users(user_ids):
+    """Блокирует строки пользователей до конца транзакции.
+    Строки берутся в порядке id, чтобы встречные блокировки
+    нескольких пользователей не приводили к взаимоблокировке."""
+    list(CustomUser.objects.select_for_update().filter(
+        pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def update_shopping_lists(user_ids, delta):
+    """Инкрементально применяет изменения к сводным спискам покупок.
+    delta - словарь {id ингредиента: изменение количества},
+    позиции с нулевым или отрицательным остатком удаляются.
+    SELECT FOR UPDATE не блокирует еще не созданные позиции,
+    поэтому изменения списков одного пользователя сериализуются
+    блокировкой его строки: иначе две транзакции могут одновременно
+    создать одну позицию и нарушить уникальность (user, ingredient)."""
+    delta = {key: value for key, value in delta.items() if value}
+    user_ids = list(user_ids)
+    if not user_ids or not delta:
+        return
+    with transaction.atomic():
+        lock_users(user_ids)
+        existing = {
+            (item.user_id, item.ingredient_id): item
+            for item in ShoppingListItem.objects.select_for_update().filter(
+                user__in=user_ids, ingredient__in=delta)
+        }
+        to_create, to_update, to_delete = [], [], []
+        for user_id in user_ids:
+            for ingredient_id, amount in delta.items():
+                item = existing.get((user_id, ingredient_id))
+                if item is None:
+                    if amount > 0:
+                        to_create.append(ShoppingListItem(
+                            user_id=user_id, ingredient_id=ingredient_id,
+                            amount=amount))
+                    continue
+                item.amount += amount
+                if item.amount > 0:
+                    to_update.append(item)
+                else:
+                    to_delete.append(item.pk)
+        ShoppingListItem.objects.bulk_create(to_create)
+        ShoppingListItem.objects.bulk_update(to_update, ('amount',))
+        ShoppingListItem.objects.filter(pk__in=to_delete).delete()
+
+
+def add_to_shopping_list(user, recipe):
+    """Добавляет ингредиенты рецепта в сводный список покупок."""
+    update_shopping_lists((user.id,), recipe_amounts(recipe))
+
+
+def remove_from_shopping_list(user, recipe):
+    """Вычитает ингредиенты рецепта из сводного списка покупок."""
+    update_shopping_lists(
+        (user.id,),
+        {key: -value for key, value in recipe_amounts(recipe).items()})
+
+
+def update_recipe_in_shopping_lists(recipe, old_amounts, new_amounts=None):
+    """Пересчитывает списки покупок всех пользователей,
+    у которых рецепт в корзине, после изменения его ингредиентов.
+    new_amounts, если не передан, читается из базы."""
+    if new_amounts is None:
+        new_amounts = recipe_amounts(recipe)
+    delta = {
+        key: new_amounts.get(key, 0) - old_amounts.get(key, 0)
+        for key in new_amounts.keys() | old_amounts.keys()
+    }
+    update_shopping_lists(
+        ShoppingCart.objects.filter(recipe=recipe).values_list(
+            'user', flat=True),
+        delta)
+
+
+def build_shopping_lists():
+    """Строит сводные списки покупок с нуля по корзинам пользователей.
+    Возвращает словарь {id пользователя: {id ингредиента: количество}}."""
+    shopping_lists = defaultdict(dict)
+    rows = IngredientInRecipe.objects.filter(
+        name__recipe_in_cart__isnull=False
+    ).values_list('name__recipe_in_cart__user', 'ingredient').annotate(
+        total=Sum('amount')).order_by()
+    for user_id, ingredient_id, amount in rows.iterator():
+        shopping_lists[user_id][ingredient_id] = amount
+    return shopping_lists
+
+
+def stored_shopping_lists():
+    """Возвращает сохраненные сводные списки покупок
+    в том же виде, что и build_shopping_lists()."""
+    shopping_lists = defaultdict(dict)
+    rows = ShoppingListItem.objects.values_list(
+        'user', 'ingredient', 'amount')
+    for user_id, ingredient_id, amount in rows.iterator():
+        shopping_lists[user_id][ingredient_id] = amount
+    return shopping_lists
+
+
+@transaction.atomic
+def replace_shopping_list(user_id, amounts):
+    """Полностью перезаписывает сводный список покупок пользователя."""
+    ShoppingListItem.objects.filter(user=user_id).delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                         amount=amount)
+        for ingredient_id, amount in amounts.items()
+    )
+
+
+def change_counter(recipe_id, field, delta):
+    """Атомарно меняет счетчик популярности рецепта
+    (favorites_count или in_carts_count) на delta."""
+    change_counters((recipe_id,), field, delta)
+
+
+def change_counters(recipe_ids, field, delta):
+    """То же для нескольких рецептов одним UPDATE."""
+    if Recipe.objects.filter(pk__in=recipe_ids).update(
+            **{field: Greatest(F(field) + delta, 0)}):
+        popularity_changed.send(sender=Recipe)
+
+
+def actual_counters():
+    """Рецепты с фактическими значениями счетчиков популярности
+    в аннотациях actual_<поле>."""
+    return Recipe.objects.annotate(**{
+        f'actual_{field}': Coalesce(Subquery(
+            model.objects.filter(recipe=OuterRef('pk')).order_by().values(
+                'recipe').annotate(total=Count('id')).values('total')
+        ), Value(0))
+        for field, model in POPULARITY_COUNTERS.items()
+    })